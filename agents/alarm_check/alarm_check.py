@@ -17,15 +17,29 @@ if "log" in cfg:
 
 log = logging.getLogger("alarm_check")
 
-poll = opts.get("--poll") or cfg.get("poll", None)
-if poll:
-    m = re.fullmatch(r"0*([1-9]\d*)\s*(m?s)", poll)
+
+def parse_interval(name, value):
+    m = re.fullmatch(r"0*([1-9]\d*)\s*(m?s)", value)
     if not m:
-        raise Exception(f"Poll must be positive integer seconds (5s) or milliseconds (200ms). {poll} was given.")
-    poll = int(m[1])
+        raise Exception(f"{name} must be positive integer seconds (5s) or milliseconds (200ms). {value} was given.")
+    value = int(m[1])
     if m[2] == "ms":
-        poll = poll / 1000.0
-    log.debug(f"poll: {poll}s")
+        value = value / 1000.0
+    log.debug(f"{name.lower()}: {value}s")
+    return value
+
+
+poll = opts.get("--poll") or cfg.get("poll", None)
+if poll:
+    poll = parse_interval("Poll", poll)
+
+# event driven: the api returns when new log rows arrived, or after wait, with a check of all alarms
+wait = opts.get("--wait") or cfg.get("wait", None)
+if wait:
+    wait = parse_interval("Wait", wait)
+
+incremental = "--incremental" in sys.argv or bool(cfg.get("incremental", False))
+parallel = "--parallel" in sys.argv or bool(cfg.get("parallel", False))
 
 profile = opts.get("--profile") or cfg.get("profile", None)
 log.debug(f"using profile {profile}")
@@ -36,7 +50,7 @@ while True:
     try:
         log.debug(f"checking")
 
-        alarms = i4c_conn.alarm.check(noaudit=True)
+        alarms = i4c_conn.alarm.check(noaudit=True, incremental=incremental, parallel=parallel, wait=wait)
 
         for a in alarms:
             name = a.get("alarm")
@@ -44,6 +58,12 @@ while True:
 
     except Exception as e:
         log.error(f"{e}")
+        if wait:
+            # no tight loop while the api is down
+            time.sleep(poll or 1)
+
+    if wait:
+        continue
 
     if poll is None:
         break
@@ -7,7 +7,15 @@ import logging.config
 import yaml
 import i4c
 import re
-import tempfile
+import sys
+import json
+import time
+import queue
+import locale
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from i4c.spool import LogSpool
+from i4c.tools import jsonify
 
 robot_actions = {
     "Darab beérkezett": ("state", "spotted"),
@@ -51,12 +59,17 @@ robot_alarms = {
 cfg: dict
 conn: i4c.I4CConnection
 log: logging.Logger
+spool: Optional[LogSpool] = None
+
+# the alarm files are read in binary to track the offset, and decoded the way open() in text mode would
+alarm_encoding = locale.getpreferredencoding(False)
 
 
 def init_globals():
     global cfg
     global log
     global conn
+    global spool
 
     with open("log_grab.conf") as f:
         cfg = yaml.load(f, Loader=yaml.FullLoader)
@@ -68,6 +81,10 @@ def init_globals():
     profile = cfg.get("profile", None)
     conn = i4c.I4CConnection(profile=profile)
 
+    if "spool" in cfg:
+        spool = LogSpool(cfg["spool"], lambda body: conn.invoke_url("log", "POST", bindata=body,
+                                                                    data_content_type="application/json"))
+
 
 def check_params(paths):
     result = {"source-path": None, "archive-path": None, "OK": False}
@@ -101,9 +118,170 @@ def get_datetime(source, format):
     return datetime.datetime.strptime(source, format).strftime("%Y-%m-%dT%H:%M:%S")
 
 
-def process_robot(section):
+def scan_dir(path):
+    """
+    Lists the files in the directory, with one directory read. Returns a dict of lowercase name to name,
+    the file shares are case insensitive.
+    """
+    with os.scandir(path) as it:
+        return {entry.name.lower(): entry.name for entry in it if entry.is_file()}
+
+
+def index_GOM(files):
+    """Indexes the GOM file groups by the uppercase workpiece id, which is the part after an underscore."""
+    groups = {}
+    for entry in files.values():
+        (file_group, marker) = os.path.splitext(entry)
+        if marker.upper() not in (".OK", ".ERROR"):
+            continue
+        # the workpiece id may contain underscores, so every suffix is a candidate
+        for (pos, c) in enumerate(file_group):
+            if c == "_":
+                groups.setdefault(file_group[pos + 1:].upper(), []).append((file_group, marker))
+    return groups
+
+
+def index_ReniShaw(files):
+    """Indexes the ReniShaw print files by the uppercase workpiece id."""
+    result = {}
+    for entry in files.values():
+        mo = re.match(r"^print_(?P<wkpcid>.+)\.txt$", entry, re.IGNORECASE)
+        if mo:
+            result.setdefault(mo.group("wkpcid").upper(), []).append(entry)
+    return result
+
+
+def forget_file(dirs, fullname):
+    """Removes a file from the directory listings. Moves out of a watched directory are not always reported."""
+    (path, name) = os.path.split(fullname)
+    for (section, files) in dirs.items():
+        if os.path.abspath(cfg[section]["source-path"]) == os.path.abspath(path):
+            files.pop(name.lower(), None)
+
+
+def source_index(section, indexer, files=None):
+    """
+    Indexes the source directory of a section, scanning it if the files are not given.
+    Returns (params, files, index), or None if the section is not usable.
+    """
+    params = check_params(section)
+    if not params["OK"]:
+        return None
+    if files is None:
+        files = scan_dir(params["source-path"])
+    return params, files, indexer(files)
+
+
+def process_robot(section, dirs=None):
+    """
+    Processes the robot FINISH.CSV files, and the GOM and ReniShaw files belonging to them.
+    `dirs` can give the content of the source directories by section name, as returned by scan_dir.
+    Directories not in it are scanned.
+    """
     log.debug("processing ROBOT files")
+    dirs = dirs or {}
+
+    params = check_params(section)
+    if not params["OK"]:
+        return
+
+    src_path = params["source-path"]
+
+    if "robot" in dirs:
+        # the listing can lag behind the directory, the candidates are checked
+        files = sorted(entry for entry in dirs["robot"].values() if entry.upper().endswith("FINISH.CSV")
+                       and os.path.isfile(os.path.join(src_path, entry)))
+    else:
+        files = sorted(entry for entry in scan_dir(src_path).values() if entry.upper().endswith("FINISH.CSV"))
+    if len(files) == 0:
+        log.debug("No files to load")
+        return
+
+    gom = source_index(cfg["gom"], index_GOM, dirs.get("gom")) if "gom" in cfg else None
+    renishaw = source_index(cfg["renishaw"], index_ReniShaw, dirs.get("renishaw")) if "renishaw" in cfg else None
+
+    workers = int(cfg.get("workers", 4))
+    batch_size = int(cfg.get("batch-size", 10000))
 
+    entries = []
+    moves = []
+
+    def flush():
+        # the files are archived only after their log entries are written
+        try:
+            if entries:
+                log.debug(f"writing log entries: {len(entries)}")
+                post_log_stream(entries)
+        except Exception as E:
+            log.error(E)
+            moves.clear()
+        log.debug(f"archiving files: {len(moves)}")
+        for (source, target) in moves:
+            try:
+                shutil.move(source, target)
+                forget_file(dirs, source)
+            except Exception as E:
+                log.error(E)
+        entries.clear()
+        moves.clear()
+
+    # workpieces are processed in parallel, file uploads have their own pool, so a worker never waits for itself
+    with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=workers) as uploader:
+        # the robot files are read first, and grouped by workpiece: the GOM and ReniShaw files of a workpiece are
+        # processed once, by one worker, whatever number of robot files refer to it
+        parsed = {pool.submit(parse_robot, os.path.join(src_path, currentfile)): currentfile for currentfile in files}
+        workpieces = {}
+        for future in as_completed(parsed):
+            try:
+                (wkpcid, wp_entries) = future.result()
+            except Exception as E:
+                log.error(f"{parsed[future]}: {E}")
+                continue
+            workpieces.setdefault(wkpcid.upper(), []).append((parsed[future], wkpcid, wp_entries))
+
+        futures = {pool.submit(process_workpiece, params, sorted(robot), gom, renishaw, uploader): wkpcid
+                   for (wkpcid, robot) in workpieces.items()}
+        for future in as_completed(futures):
+            try:
+                (wp_entries, wp_moves) = future.result()
+            except Exception as E:
+                log.error(f"{futures[future]}: {E}")
+                continue
+            entries.extend(wp_entries)
+            moves.extend(wp_moves)
+            if len(entries) >= batch_size:
+                flush()
+        flush()
+
+
+def process_workpiece(params, robot, gom, renishaw, uploader):
+    """
+    Processes the robot FINISH.CSV files of a workpiece, parsed as (file name, workpiece id, log entries), and
+    the GOM and ReniShaw files of the workpiece. Returns the log entries, and the (source, target) pairs of the
+    files to archive.
+    """
+    entries = []
+    moves = []
+    for (currentfile, wkpcid, robot_entries) in robot:
+        log.info("Processing file %s", currentfile)
+        entries.extend(robot_entries)
+        moves.append((os.path.join(params["source-path"], currentfile),
+                      os.path.join(params["archive-path"], currentfile)))
+    wkpcid = robot[0][1]
+
+    if gom is not None:
+        (gom_entries, gom_moves) = process_GOM(gom, wkpcid, uploader)
+        entries.extend(gom_entries)
+        moves.extend(gom_moves)
+    if renishaw is not None:
+        (renishaw_entries, renishaw_moves) = process_ReniShaw(renishaw, wkpcid)
+        entries.extend(renishaw_entries)
+        moves.extend(renishaw_moves)
+    return entries, moves
+
+
+def parse_robot(filename):
+    """Reads a robot FINISH.CSV file. Returns the workpiece id and the log entries."""
     api_params = {
         "timestamp": None,
         "sequence": -1,
@@ -117,82 +295,76 @@ def process_robot(section):
         "value_add": None
     }
 
-    params = check_params(section)
-    if not params["OK"]:
-        return
+    wkpcid = None
+    progid = None
+    api_params_array = []
+    with open(filename) as csvfile:
+        csvreader = csv.reader(csvfile, delimiter=";", quotechar=None)
+        for lines in csvreader:
+            if len(lines) != 2:
+                if lines[0].upper() == "Naplózott események".upper():
+                    continue
+                raise Exception(f"Line {csvreader.line_num} in wrong format!")
+
+            if lines[0].upper() == "Munkadarab azonosítója".upper():
+                wkpcid = lines[1]
+            elif lines[0].upper() == "Program neve".upper():
+                progid = lines[1]
+            elif csvreader.line_num >= 5:
+                if csvreader.line_num == 5:
+                    if wkpcid is None:
+                        raise Exception("Workpiece id is not set!")
+                    if progid is None:
+                        raise Exception("Program id is not set!")
+                    api_params["sequence"] = 0
+                    api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
+                    api_params["data_id"] = "wkpcid"
+                    api_params["value_text"] = wkpcid
+                    api_params["value_extra"] = None
+                    api_params_array.append(copy.deepcopy(api_params))
+                    api_params["sequence"] += 1
+                    api_params["data_id"] = "pgm"
+                    api_params["value_text"] = progid
+                    api_params_array.append(copy.deepcopy(api_params))
+                    api_params["sequence"] += 1
+                    api_params["data_id"] = "robot_control"
+                    api_params["value_text"] = "active"
+                    api_params_array.append(copy.deepcopy(api_params))
 
-    src_path = params["source-path"]
+                api_params["sequence"] += 1
+                api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
+                (did, value) = robot_actions.get(lines[1], ("state", "unknown"))
+                api_params["data_id"] = did
+                api_params["value_text"] = value
+                api_params["value_extra"] = lines[1]
+                api_params_array.append(copy.deepcopy(api_params))
+                api_params["value_extra"] = None
 
-    files = [entry for entry in os.listdir(src_path) if
-             os.path.isfile(os.path.join(src_path, entry))
-             and entry.upper().endswith("FINISH.CSV")]
-    if len(files) == 0:
-        log.debug("No files to load")
-        return
-    for currentfile in files:
-        wkpcid = None
-        progid = None
-        api_params_array = []
-        log.info("Processing file %s", currentfile)
-        try:
-            with open(os.path.join(src_path, currentfile)) as csvfile:
-                csvreader = csv.reader(csvfile, delimiter=";", quotechar=None)
-                for lines in csvreader:
-                    if len(lines) != 2:
-                        if lines[0].upper() == "Naplózott események".upper():
-                            continue
-                        log.error(f"Line {csvreader.line_num} in wrong format!")
-                        return
-
-                    if lines[0].upper() == "Munkadarab azonosítója".upper():
-                        wkpcid = lines[1]
-                    elif lines[0].upper() == "Program neve".upper():
-                        progid = lines[1]
-                    elif csvreader.line_num >= 5:
-                        if csvreader.line_num == 5:
-                            if wkpcid is None:
-                                log.error("Workpiece id is not set!")
-                                return
-                            if progid is None:
-                                log.error("Program id is not set!")
-                                return
-                            api_params["sequence"] = 0
-                            api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
-                            api_params["data_id"] = "wkpcid"
-                            api_params["value_text"] = wkpcid
-                            api_params["value_extra"] = None
-                            api_params_array.append(copy.deepcopy(api_params))
-                            api_params["sequence"] += 1
-                            api_params["data_id"] = "pgm"
-                            api_params["value_text"] = progid
-                            api_params_array.append(copy.deepcopy(api_params))
-                            api_params["sequence"] += 1
-                            api_params["data_id"] = "robot_control"
-                            api_params["value_text"] = "active"
-                            api_params_array.append(copy.deepcopy(api_params))
+    if wkpcid is None:
+        raise Exception("Workpiece id is not set!")
+
+    # reusing last timestamp
+    api_params["sequence"] += 1
+    api_params["data_id"] = "robot_control"
+    api_params["value_text"] = "inactive"
+    api_params_array.append(copy.deepcopy(api_params))
+
+    return wkpcid, api_params_array
+
+
+def post_log(entries):
+    if spool is not None:
+        spool.append(jsonify(entries).encode())
+    else:
+        conn.invoke_url("log", "POST", entries)
 
-                        api_params["sequence"] += 1
-                        api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
-                        (did, value) = robot_actions.get(lines[1], ("state", "unknown"))
-                        api_params["data_id"] = did
-                        api_params["value_text"] = value
-                        api_params["value_extra"] = lines[1]
-                        api_params_array.append(copy.deepcopy(api_params))
-                        api_params["value_extra"] = None
-
-            # reusing last timestamp
-            api_params["sequence"] += 1
-            api_params["data_id"] = "robot_control"
-            api_params["value_text"] = "inactive"
-            api_params_array.append(copy.deepcopy(api_params))
-
-            conn.invoke_url("log", "POST", api_params_array)
-            process_GOM(cfg["gom"], wkpcid)
-            process_ReniShaw(cfg["renishaw"], wkpcid)
-            log.debug("Archiving file...")
-            shutil.move(os.path.join(src_path, currentfile), os.path.join(params["archive-path"], currentfile))
-        except Exception as E:
-            log.error(E)
+
+def post_log_stream(entries):
+    if spool is not None:
+        spool.append(jsonify(entries).encode())
+        return
+    body = "\n".join(jsonify(e) for e in entries).encode()
+    conn.invoke_url("log/stream", "POST", bindata=body, data_content_type="application/x-ndjson")
 
 
 def safe_float(s):
@@ -208,26 +380,30 @@ def safe_float(s):
     return f
 
 
-def process_GOM(section, wkpcid):
-    log.debug(f"Processing GOM files for {wkpcid}")
+def upload_file(datafile, datafilename):
+    with open(datafile, "rb") as f:
+        conn.invoke_url("intfiles/v/1/" + datafilename, "PUT", f)
 
-    params = check_params(section)
-    if not params["OK"]:
-        return
 
+def process_GOM(source, wkpcid, uploader):
+    """
+    Reads the GOM file groups of the workpiece, and uploads the data files on the uploader pool.
+    `source` is the result of source_index. Returns the log entries and the files to archive.
+    """
+    log.debug(f"Processing GOM files for {wkpcid}")
+
+    (params, files, index) = source
     src_path = params["source-path"]
 
-    file_groups = [entry for entry in os.listdir(src_path)
-                   if os.path.isfile(os.path.join(src_path, entry))
-                   and (entry.upper().endswith(f"_{wkpcid}.OK") or entry.upper().endswith(f"_{wkpcid}.ERROR"))]
+    file_groups = sorted(index.get(wkpcid.upper(), []))
 
     if len(file_groups) == 0:
         log.debug("no file groups to load")
-        return
-
-    file_groups = [os.path.splitext(g) for g in file_groups]
+        return [], []
 
     entries = []
+    moves = []
+    uploads = []
     sequence = 0
 
     for (file_group, marker) in file_groups:
@@ -235,12 +411,12 @@ def process_GOM(section, wkpcid):
 
         markfile = os.path.join(src_path, f"{file_group}{marker}")
 
-        logfile = os.path.join(src_path, f"{file_group}.log")
-        if os.path.isfile(logfile):
+        logfile = files.get(f"{file_group}.log".lower())
+        if logfile is not None:
             log.debug("loading log")
             first_time = None
             last_time = None
-            with open(logfile) as f:
+            with open(os.path.join(src_path, logfile)) as f:
                 for line in f:
                     entry = dict(device="gom", sequence=sequence)
                     sequence += 1
@@ -272,10 +448,10 @@ def process_GOM(section, wkpcid):
         sequence += 1
         entries.append(entry)
 
-        csvfile = os.path.join(src_path, f"{file_group}.csv")
-        if os.path.isfile(csvfile):
+        csvfile = files.get(f"{file_group}.csv".lower())
+        if csvfile is not None:
             log.debug("loading csv")
-            with open(csvfile) as f:
+            with open(os.path.join(src_path, csvfile)) as f:
                 csvreader = csv.reader(f, delimiter=";", quotechar=None)
                 for lines in csvreader:
                     if csvreader.line_num == 1:
@@ -320,11 +496,10 @@ def process_GOM(section, wkpcid):
 
         for ext in (".pdf", ".atos"):
             datafilename = f"{file_group}{ext}"
-            datafile = os.path.join(src_path, datafilename)
-            if os.path.isfile(datafile):
+            if datafilename.lower() in files:
+                datafile = os.path.join(src_path, files[datafilename.lower()])
                 log.debug(f"uploading {datafilename}")
-                with open(datafile, "rb") as f:
-                    conn.invoke_url("intfiles/v/1/" + datafilename, "PUT", f)
+                uploads.append(uploader.submit(upload_file, datafile, datafilename))
                 entry = dict(
                     device="gom",
                     timestamp=last_time,
@@ -336,23 +511,22 @@ def process_GOM(section, wkpcid):
             else:
                 log.error(f"not found {datafilename}")
 
-        log.debug(f"writing log entries: {len(entries)}")
-        conn.invoke_url("log", "POST", entries)
-
         for ext in (".ok", ".error", ".pdf", ".atos", ".log", ".csv", ".bad", ".good"):
-            filename = f"{file_group}{ext}"
-            sourcefile = os.path.join(src_path, filename)
-            if os.path.isfile(sourcefile):
-                log.debug(f"archiving file {filename}")
-                shutil.move(sourcefile, os.path.join(params["archive-path"], filename))
+            filename = files.get(f"{file_group}{ext}".lower())
+            if filename is not None:
+                moves.append((os.path.join(src_path, filename), os.path.join(params["archive-path"], filename)))
 
+    for upload in uploads:
+        upload.result()
+
+    return entries, moves
 
-def process_Alarms(section):
-    log.debug("Processing ALARM files...")
 
+def parse_alarms(lines, sequence):
+    """Converts alarm csv lines to log entries, numbered from sequence."""
     api_params = {
         "timestamp": "2021-12-07T11:20:20.405Z",
-        "sequence": None,
+        "sequence": sequence,
         "device": "robot",
         "instance": 0,
         "data_id": '',
@@ -362,6 +536,67 @@ def process_Alarms(section):
         "value_extra": None,
         "value_add": None
     }
+    api_params_array = []
+    csvreader = csv.reader(lines, delimiter=";", quotechar=None)
+    for lines in csvreader:
+        api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
+        api_params["data_id"] = "alarm"
+        api_params["value_text"] = robot_alarms.get(lines[1], "other_alarm")
+        api_params["value_extra"] = lines[1]
+        api_params_array.append(copy.deepcopy(api_params))
+        api_params["sequence"] += 1
+    return api_params_array
+
+
+def load_alarm_state(section):
+    try:
+        with open(section.get("state-path", "alarms.state")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_alarm_state(section, state):
+    fn = section.get("state-path", "alarms.state")
+    with open(fn + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(fn + ".tmp", fn)
+
+
+def tail_alarm_file(fullname, name, state, final):
+    """
+    Uploads the lines of the alarm file written since the offset in the state, and returns the new state.
+    The last line is only read if it is complete, or if the file is final.
+    """
+    if state.get("file") != name:
+        state = {"file": name, "offset": 0, "sequence": 0}
+
+    with open(fullname, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < state["offset"]:
+            log.warning(f"{name} got shorter, reading it again")
+            state = {"file": name, "offset": 0, "sequence": 0}
+        f.seek(state["offset"])
+        data = f.read()
+
+    end = len(data) if final else data.rfind(b"\n") + 1
+    if end == 0:
+        return state
+
+    api_params_array = parse_alarms(data[:end].decode(alarm_encoding).splitlines(), state["sequence"])
+    log.debug(f"writing {len(api_params_array)} records")
+    post_log(api_params_array)
+    return {"file": name, "offset": state["offset"] + end, "sequence": state["sequence"] + len(api_params_array)}
+
+
+def process_Alarms(section, files=None):
+    """
+    Uploads the alarm files. The file of the current day is still being written, it is read from the offset
+    saved in the state file, up to the last complete line. Files of earlier days are read to the end, and archived.
+    `files` is the content of the source directory as returned by scan_dir, it is scanned if not given.
+    """
+    log.debug("Processing ALARM files...")
+
     params = check_params(section)
     if not params["OK"]:
         return
@@ -369,62 +604,44 @@ def process_Alarms(section):
     src_path = params["source-path"]
     ref_date = datetime.date.today().strftime("%Y.%m.%d")
 
-    files = [entry for entry in os.listdir(src_path) if os.path.isfile(os.path.join(src_path, entry))
-             and any(entry.upper().endswith(ext) for ext in (".CSV"))
-             and os.path.splitext(entry)[0] <= ref_date]
+    listing = files if files is not None else scan_dir(src_path)
+    files = sorted(entry for entry in listing.values()
+                   if entry.upper().endswith(".CSV")
+                   and os.path.splitext(entry)[0] <= ref_date)
     if len(files) == 0:
         log.debug("no files to load")
         return
 
-    current_file = dict()
+    state = load_alarm_state(section)
     for currentfile in files:
         log.debug(f"found {currentfile}")
-        current_file["name"] = currentfile
-        current_file["path"] = src_path
-        current_file["fullname"] = os.path.join(src_path, currentfile)
+        fullname = os.path.join(src_path, currentfile)
 
         try:
             fname, _ = os.path.splitext(currentfile)
-            if fname == ref_date:
-                log.debug("processing active file %s", current_file["fullname"])
-                tmp_dir = tempfile.gettempdir()
-                tmp_file = os.path.join(tmp_dir, current_file["name"])
-                log.debug(f"creating temp file {tmp_file}")
-                shutil.copyfile(current_file["fullname"], tmp_file)
-                current_file["path"] = tmp_dir
-                current_file["fullname"] = tmp_file
-                current_file["move"] = False
+            final = fname != ref_date
+            if final:
+                log.info("processing final file %s", fullname)
             else:
-                log.info("processing final file %s", current_file["fullname"])
-                current_file["move"] = True
-
-            log.debug("opening csv")
-            with open(current_file["fullname"]) as csvfile:
-                csvreader = csv.reader(csvfile, delimiter=";", quotechar=None)
-                api_params_array = []
-                api_params["sequence"] = 0
-                for lines in csvreader:
-                    api_params["timestamp"] = get_datetime(lines[0], "%Y.%m.%d %H:%M:%S")
-                    api_params["data_id"] = "alarm"
-                    api_params["value_text"] = robot_alarms.get(lines[1], "other_alarm")
-                    api_params["value_extra"] = lines[1]
-                    api_params_array.append(copy.deepcopy(api_params))
-                    api_params["sequence"] += 1
-                csvfile.close()
-            log.debug(f"writing {len(api_params_array)} records")
-            conn.invoke_url("log", "POST", api_params_array)
-            if current_file["move"]:
+                log.debug("processing active file %s", fullname)
+
+            state = tail_alarm_file(fullname, currentfile, state, final)
+            save_alarm_state(section, state)
+
+            if final:
                 log.debug("archiving file")
-                shutil.move(current_file["fullname"], os.path.join(params["archive-path"], current_file["name"]))
-            else:
-                log.debug("deleting temp file")
-                os.remove(current_file["fullname"])
+                shutil.move(fullname, os.path.join(params["archive-path"], currentfile))
+                listing.pop(currentfile.lower(), None)
         except Exception as E:
             log.error(E)
     log.debug("alarms done")
 
 
-def process_ReniShaw(section, wkpcid):
+def process_ReniShaw(source, wkpcid):
+    """
+    Reads the ReniShaw print files of the workpiece. `source` is the result of source_index.
+    Returns the log entries and the files to archive.
+    """
     log.debug(f"Processing ReniShaw files ({wkpcid})...")
     api_params = {
         "timestamp": "2021-12-07T11:20:20.405Z",
@@ -439,19 +656,17 @@ def process_ReniShaw(section, wkpcid):
         "value_add": None
     }
 
-    params = check_params(section)
-    if not params["OK"]:
-        return
-
-    src_path = section["source-path"]
+    (params, _, index) = source
+    src_path = params["source-path"]
 
-    files = [entry for entry in os.listdir(src_path) if os.path.isfile(os.path.join(src_path, entry))
-             and re.match(r"^print_" + wkpcid + r".txt", entry, re.IGNORECASE)]
+    files = sorted(index.get(wkpcid.upper(), []))
 
     if len(files) == 0:
         log.debug("no files to load")
-        return
+        return [], []
 
+    entries = []
+    moves = []
     for currentfile in files:
         log.info("processing file %s", currentfile)
 
@@ -464,7 +679,7 @@ def process_ReniShaw(section, wkpcid):
                 lines = lines.strip()
                 if lines == '%':
                     if len(api_params_array) != 0:
-                        conn.invoke_url("log", "POST", api_params_array)
+                        entries.extend(api_params_array)
                         api_params_array.clear()
 
                         measure = None
@@ -531,18 +746,116 @@ def process_ReniShaw(section, wkpcid):
                     measure = mo.group("measure_name")
                     continue
             srcfile.close()
-        log.debug("archiving file")
-        shutil.move(os.path.join(src_path, currentfile), os.path.join(params["archive-path"], currentfile))
+        moves.append((os.path.join(src_path, currentfile), os.path.join(params["archive-path"], currentfile)))
+
+    return entries, moves
+
+
+def watch():
+    """
+    Runs until interrupted, and processes the files as soon as they appear, based on file system events.
+    The directories are scanned once at the start, then the listings are kept up to date from the events.
+    Processing starts when no event came for `settle` seconds, so files still being written are left alone,
+    but at most `max-wait` seconds after the first event.
+    The alarm files are also checked every `interval` seconds, to close the previous day's file.
+    """
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+
+    watch_cfg = cfg.get("watch", None) or {}
+    settle = float(watch_cfg.get("settle", 2))
+    max_wait = float(watch_cfg.get("max-wait", 30))
+    interval = float(watch_cfg.get("interval", 60))
+
+    events = queue.Queue()
+
+    class Handler(FileSystemEventHandler):
+        def __init__(self, name):
+            self.name = name
+
+        def on_any_event(self, event):
+            # opened and closed events come from reading the files, processing itself
+            if not event.is_directory and event.event_type in ("created", "modified", "deleted", "moved"):
+                events.put((self.name, event))
+
+    observer = Observer()
+    dirs = {}
+    for name in ("robot", "gom", "renishaw", "alarms"):
+        if name in cfg and check_params(cfg[name])["OK"]:
+            path = cfg[name]["source-path"]
+            observer.schedule(Handler(name), path)
+            dirs[name] = scan_dir(path)
+    observer.start()
+    log.info(f"watching {', '.join(dirs)}")
+
+    def apply(name, event):
+        files = dirs[name]
+        if event.event_type in ("created", "modified"):
+            files[os.path.basename(event.src_path).lower()] = os.path.basename(event.src_path)
+        elif event.event_type == "deleted":
+            files.pop(os.path.basename(event.src_path).lower(), None)
+        elif event.event_type == "moved":
+            files.pop(os.path.basename(event.src_path).lower(), None)
+            if os.path.dirname(os.path.abspath(event.dest_path)) == os.path.abspath(cfg[name]["source-path"]):
+                files[os.path.basename(event.dest_path).lower()] = os.path.basename(event.dest_path)
+
+    try:
+        if "robot" in dirs:
+            process_robot(cfg["robot"], dirs)
+        if "alarms" in dirs:
+            process_Alarms(cfg["alarms"], dirs["alarms"])
+        next_alarms = time.monotonic() + interval
+
+        while True:
+            changed = set()
+            try:
+                (name, event) = events.get(timeout=max(next_alarms - time.monotonic(), 0))
+                apply(name, event)
+                changed.add(name)
+                deadline = time.monotonic() + max_wait
+                while time.monotonic() < deadline:
+                    (name, event) = events.get(timeout=min(settle, max(deadline - time.monotonic(), 0)))
+                    apply(name, event)
+                    changed.add(name)
+            except queue.Empty:
+                pass
+
+            if "robot" in changed:
+                process_robot(cfg["robot"], dirs)
+            if "alarms" in dirs and ("alarms" in changed or time.monotonic() >= next_alarms):
+                process_Alarms(cfg["alarms"], dirs["alarms"])
+                next_alarms = time.monotonic() + interval
+    finally:
+        observer.stop()
+        observer.join()
 
 
 def main():
+    if "--watch" in sys.argv:
+        try:
+            import watchdog
+        except ImportError:
+            raise Exception("Watch mode requires the watchdog package, install the requirements.txt of log_grab.")
+
     init_globals()
     log.debug("start")
 
-    if "robot" in cfg:
-        process_robot(cfg["robot"])
-    if "alarms" in cfg:
-        process_Alarms(cfg["alarms"])
+    if "--watch" in sys.argv:
+        if spool is not None:
+            spool.start_sender()
+        watch()
+    else:
+        if "robot" in cfg:
+            process_robot(cfg["robot"])
+        if "alarms" in cfg:
+            process_Alarms(cfg["alarms"])
+
+    if spool is not None:
+        spool.close()
+        try:
+            spool.drain()
+        except Exception as E:
+            log.error(f"spool upload failed, will retry on the next run: {E}")
 
     log.debug("finish")
 
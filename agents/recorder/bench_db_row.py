@@ -0,0 +1,78 @@
+"""
+Micro benchmark of the recorder row handling: timestamp parsing and encoding a batch to the log POST body.
+
+USAGE: bench_db_row.py [sample.xml] [repeat]
+
+sample.xml is a recorded /sample response. If omitted, a synthetic document with 1000 items is used.
+"""
+import io
+import re
+import sys
+import time
+import random
+import db_row
+import mtconnect
+from i4c.tools import jsonify
+
+
+def synthetic_document(count=1000):
+    items = []
+    ts = None
+    for seq in range(1, count + 1):
+        if seq % 5 == 1:  # items of a scan share the timestamp
+            ts = f"2021-08-24T07:{seq // 600 % 60:02}:{seq // 10 % 60:02}.{random.randint(0, 999999):06}Z"
+        if seq % 3 == 0:
+            items.append(f'<Samples><Position dataItemId="xpw" timestamp="{ts}" sequence="{seq}">{random.random() * 100}</Position></Samples>')
+        elif seq % 3 == 1:
+            items.append(f'<Events><Execution dataItemId="exec" timestamp="{ts}" sequence="{seq}">ACTIVE</Execution></Events>')
+        else:
+            items.append(f'<Condition><Normal dataItemId="system" timestamp="{ts}" sequence="{seq}" type="SYSTEM"/></Condition>')
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<MTConnectStreams xmlns="urn:mtconnect.org:MTConnectStreams:1.3">'
+            f'<Header instanceId="1" nextSequence="{count + 1}" firstSequence="1" lastSequence="{count}"/>'
+            '<Streams><DeviceStream name="m"><ComponentStream component="Controller">'
+            + "".join(items) +
+            '</ComponentStream></DeviceStream></Streams></MTConnectStreams>').encode()
+
+
+class Response(io.BytesIO):
+    class headers:
+        @staticmethod
+        def get_content_type():
+            return "text/xml"
+
+
+def timeit(name, f, repeat):
+    t = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    elapsed = (time.perf_counter() - t) / repeat
+    print(f"{name:40} {elapsed * 1000:9.3f} ms")
+    return elapsed
+
+
+def main():
+    doc = open(sys.argv[1], "rb").read() if len(sys.argv) > 1 else synthetic_document()
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    mtconnect.urllib.request.urlopen = lambda url, timeout=None: Response(doc)
+    rows = list(mtconnect.mtsample_stream("http://bench", "bench", 0, 0)[0])
+    stamps = [s.decode() for s in re.findall(rb' timestamp="([^"]+)"', doc)]
+    print(f"{len(rows)} rows")
+
+    timeit("parse document", lambda: list(mtconnect.mtsample_stream("http://bench", "bench", 0, 0)[0]), repeat)
+    timeit("parse and encode document", lambda: mtconnect.mtsample("http://bench", "bench", 0, 0), repeat)
+    def parse_cached():
+        db_row.parsedt.cache_clear()
+        return [db_row.parsedt(s) for s in stamps]
+
+    a = timeit("parsedt, normalize each", lambda: [db_row.parsedt_normalize(s) for s in stamps], repeat)
+    b = timeit("parsedt", parse_cached, repeat)
+    print(f"{'':40} x{a / b:.1f}")
+    a = timeit("encode, AsDict + jsonify", lambda: jsonify([r.AsDict() for r in rows]).encode(), repeat)
+    b = timeit("encode, rows_to_json", lambda: db_row.rows_to_json(rows).encode(), repeat)
+    print(f"{'':40} x{a / b:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
+import sys
+import json
+import math
 import datetime
+from functools import lru_cache
+from json.encoder import encode_basestring
 from pydantic.schema import datetime
 
+iso_native = sys.version_info >= (3, 11)
 
-def parsedt(s):
+
+def parsedt_normalize(s):
     d, _, t = s.partition("T")
 
     if t.endswith("Z"):
@@ -19,6 +26,17 @@ def parsedt(s):
     return datetime.fromisoformat(f"{d}T{t}{z}")
 
 
+@lru_cache(maxsize=4096)
+def parsedt(s):
+    """
+    Parses an MTConnect timestamp. Items of the same scan share the timestamp, those are parsed only once.
+    From python 3.11, fromisoformat accepts the Z suffix and any fraction length, no need to normalize.
+    """
+    if iso_native:
+        return datetime.fromisoformat(s)
+    return parsedt_normalize(s)
+
+
 def spec_attr(node):
     attrs = { k:v for (k, v) in node.attrib.items()
         if k not in ("dataItemId", "timestamp", "sequence", "name", "subType", "type")}
@@ -27,7 +45,34 @@ def spec_attr(node):
     return attrs
 
 
+def json_str(v):
+    return encode_basestring(v) if v is not None else "null"
+
+
+def json_num(v):
+    # nan and inf are not valid json, they are sent as null like the missing values
+    return float.__repr__(v) if v is not None and math.isfinite(v) else "null"
+
+
+def value_esc(v):
+    return (v or "").replace("\n", "/").replace("\t", " ")
+
+
+def row_line(r):
+    """The row as a tab separated line of the recorder output, without the line end."""
+    return (f"{r.sequence}\t{r.timestamp}\t{r.data_id}\t{value_esc(r.value_text)}\t{str(r.value_num)}"
+            f"\t{value_esc(r.value_extra)}\t{value_esc(json.dumps(r.value_add))}")
+
+
+def rows_to_json(rows):
+    """Encodes a batch of rows to the json body of the log POST, without building the intermediate dicts."""
+    return "[" + ",".join(r.AsJson() for r in rows) + "]"
+
+
 class db_row:
+    __slots__ = ["device", "instance", "timestamp", "sequence", "data_id",
+                 "value_num", "value_text", "value_extra", "value_add"]
+
     def __init__(self):
         self.device = None
         self.instance = None
@@ -50,8 +95,17 @@ class db_row:
                     value_extra=self.value_extra,
                     value_add=self.value_add)
 
+    def AsJson(self):
+        return (f'{{"device":{json_str(self.device)},"instance":{json_str(self.instance)},'
+                f'"timestamp":"{self.timestamp.isoformat(timespec="milliseconds")}","sequence":{self.sequence},'
+                f'"data_id":{json_str(self.data_id)},"value_num":{json_num(self.value_num)},'
+                f'"value_text":{json_str(self.value_text)},"value_extra":{json_str(self.value_extra)},'
+                f'"value_add":{json.dumps(self.value_add) if self.value_add is not None else "null"}}}')
+
 
 class event_db_row(db_row):
+    __slots__ = ()
+
     def __init__(self, device, instance, n):
         db_row.__init__(self)
         self.device = device
@@ -64,6 +118,8 @@ class event_db_row(db_row):
 
 
 class sample_db_row(db_row):
+    __slots__ = ()
+
     def __init__(self, device, instance, n):
         db_row.__init__(self)
         self.device = device
@@ -79,6 +135,8 @@ class sample_db_row(db_row):
 
 
 class condition_db_row(db_row):
+    __slots__ = ()
+
     def __init__(self, device, instance, n, nsdrop):
         db_row.__init__(self)
         self.device = device
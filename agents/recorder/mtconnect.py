@@ -0,0 +1,112 @@
+import urllib.request
+import xml.etree.ElementTree as xmlet
+from typing import List, Tuple
+from db_row import condition_db_row, sample_db_row, event_db_row, row_line
+
+
+data_containers = ("Samples", "Events", "Condition")
+
+
+def local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def iter_rows(events, dev, inst, nsdrop, open_nodes):
+    """
+    Yields db_row objects from the remaining iterparse events. open_nodes are the elements started but not
+    ended yet, from the root. Every element is removed from its parent as soon as it is processed, so the
+    tree never grows, and memory use does not depend on the document size. The children of a data item are
+    kept until the item is processed.
+    """
+    container = None
+    container_depth = None
+    for event, node in events:
+        if event == "start":
+            open_nodes.append(node)
+            if container is None:
+                name = local_name(node.tag)
+                if name in data_containers:
+                    container = name
+                    container_depth = len(open_nodes)
+            continue
+
+        depth = len(open_nodes)
+        open_nodes.pop()
+        if container is not None:
+            if depth > container_depth + 1:
+                continue
+            if depth == container_depth + 1:
+                if container == "Samples":
+                    yield sample_db_row(dev, inst, node)
+                elif container == "Events":
+                    yield event_db_row(dev, inst, node)
+                else:
+                    yield condition_db_row(dev, inst, node, nsdrop)
+            else:
+                container = None
+        if open_nodes:
+            # processed children were removed before, so it is the only child left
+            open_nodes[-1].remove(node)
+
+
+def mtsample_stream(host, dev, start, count, inst=None):
+    """
+    Requests a sample window, and parses it while the response is read. Returns the header stats and a
+    generator of the db_row items. The rows are produced in document order in a single pass.
+    """
+    start = f"from={start}" if start else ""
+    url = f"{host}/sample?{start}&count={count}"
+    r = urllib.request.urlopen(url, timeout=10)
+    ct = r.headers.get_content_type()
+    if ct != "text/xml":
+        raise Exception("Error: non XML content")
+
+    events = xmlet.iterparse(r, events=("start", "end"))
+    root = None
+    header = None
+    for event, node in events:
+        if event != "start":
+            continue
+        if root is None:
+            root = node
+            continue
+        if local_name(node.tag) == "Header":
+            header = node.attrib
+            break
+    if header is None:
+        raise Exception("Error: no Header in the response")
+
+    if root.tag.startswith("{"):
+        ns, _, _ = root.tag[1:].partition("}")
+        nsdrop = len(ns) + 2
+    else:
+        nsdrop = 0
+
+    newinst = header["instanceId"]
+
+    if local_name(root.tag) == "MTConnectError":
+        err = [node.text for (event, node) in events if event == "end" and local_name(node.tag) == "Error"]
+        if inst is not None and newinst != inst:
+            return iter(()), dict(inst=newinst)
+        raise Exception("\n".join(e or "" for e in err))
+
+    last = int(header["lastSequence"])
+    next = int(header["nextSequence"])
+    first = int(header["firstSequence"])
+
+    # the root and the Header are started
+    return iter_rows(events, dev, newinst, nsdrop, [root, node]), dict(next=next, last=last, first=first, inst=newinst)
+
+
+def mtsample(host, dev, start, count, inst=None) -> Tuple[str, List[str], dict]:
+    """
+    Requests a sample window, and encodes the rows while they are parsed, no row is kept. Returns the json body
+    of the log upload, the output lines of the rows, and the header stats.
+    """
+    rows, stats = mtsample_stream(host, dev, start, count, inst)
+    items = []
+    lines = []
+    for r in rows:
+        items.append(r.AsJson())
+        lines.append(row_line(r))
+    return "[" + ",".join(items) + "]", lines, stats
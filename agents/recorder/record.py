@@ -1,17 +1,16 @@
-import json
 import sys
 import datetime
 import time
 import urllib.parse
-import urllib.request
-import xml.etree.ElementTree as xmlet
-from typing import List
-from db_row import condition_db_row, sample_db_row, event_db_row, db_row
+import mtconnect
+from db_row import value_esc
 import i4c as i4c
+from i4c.spool import LogSpool
+from i4c.tools import jsonify
 from pydantic.schema import datetime
 
 if len(sys.argv) < 3:
-    print(f"USAGE: {sys.argv[0]} host device [sleeptime] [--poll] [--profile <profile>]")
+    print(f"USAGE: {sys.argv[0]} host device [sleeptime] [--poll] [--profile <profile>] [--count <count>] [--spool <dir>]")
     raise Exception("Invalid command line config.")
 
 host = sys.argv[1]
@@ -28,71 +27,48 @@ if "--profile" in sys.argv:
     profile = sys.argv[index + 1]
 else:
     profile = None
+if "--count" in sys.argv:
+    index = sys.argv.index("--count")
+    count = int(sys.argv[index + 1])
+else:
+    count = 100
+if "--spool" in sys.argv:
+    index = sys.argv.index("--spool")
+    spool_path = sys.argv[index + 1]
+else:
+    spool_path = None
 
 i4c_conn = i4c.I4CConnection(profile=profile)
 
-def mtsample(start, count, inst=None):
-    start = f"from={start}" if start else ""
-    url = f"{host}/sample?{start}&count={count}"
-    r = urllib.request.urlopen(url, timeout=10)
-    ct = r.headers.get_content_type()
-    if ct != "text/xml":
-        raise Exception("Error: non XML content")
-    xmlstr = r.read()
-    x = xmlet.fromstring(xmlstr)
-    if x.tag.startswith("{"):
-        ns = x.tag
-        ns = ns[1:]
-        ns, _, _ = ns.partition("}")
-        nsdrop = len(ns) + 2
-        n = x.find("./mtc:Header", namespaces={"mtc": ns})
-        s = x.findall(".//mtc:Samples/*", namespaces={"mtc": ns})
-        e = x.findall(".//mtc:Events/*", namespaces={"mtc": ns})
-        c = x.findall(".//mtc:Condition/*", namespaces={"mtc": ns})
-        err = x.findall(".//mtc:Errors/mtc:Error", namespaces={"mtc": ns})
-    else:
-        nsdrop = 0
-        n = x.find("./Header")
-        s = x.findall(".//Samples/*")
-        e = x.findall(".//Events/*")
-        c = x.findall(".//Condition/*")
-        err = x.findall(".//Errors/Error")
-
-    newinst = n.attrib["instanceId"]
 
-    if err:
-        if inst is not None and newinst != inst:
-            return [], dict(inst=newinst)
-        raise Exception("\n".join(e.text for e in err))
+def send_log(body: bytes):
+    i4c_conn.invoke_url("log", data=body, data_content_type="application/json")
 
-    last = int(n.attrib["lastSequence"])
-    next = int(n.attrib["nextSequence"])
-    first = int(n.attrib["firstSequence"])
 
-    s = [sample_db_row(dev, newinst, n) for n in s]
-    e = [event_db_row(dev, newinst, n) for n in e]
-    c = [condition_db_row(dev, newinst, n, nsdrop) for n in c]
-    data = s  # type: List[db_row]
-    data.extend(e)
-    data.extend(c)
+# with a spool, data is written to disk first, and a background thread uploads it. API outages do not
+# hold up sampling, and no data is lost if the agent's buffer wraps in the meantime.
+spool = LogSpool(spool_path, send_log) if spool_path else None
 
-    return data, dict(next=next, last=last, first=first, inst=newinst)
 
+def post_log(body: bytes):
+    if spool is not None:
+        spool.append(body)
+    else:
+        send_log(body)
 
-def value_esc(v):
-    return (v or "").replace("\n", "/").replace("\t", " ")
+def mtsample(start, count, inst=None):
+    return mtconnect.mtsample(host, dev, start, count, inst)
 
 
 def update_connect_state(old, new):
     if old == new:
         return old
 
-    i4c_conn.invoke_url("log",
-                        data=[dict(device=dev,
-                              timestamp=datetime.now(),
-                              sequence=0,
-                              data_id='connect',
-                              value_text=new)])
+    post_log(jsonify([dict(device=dev,
+                           timestamp=datetime.now(),
+                           sequence=0,
+                           data_id='connect',
+                           value_text=new)]).encode())
     return new
 
 
@@ -102,6 +78,8 @@ def main():
     start = None
     connect_state = None
     first_run = True
+    if spool is not None:
+        spool.start_sender(sleeptime)
     while True:
         try:
             if first_run:
@@ -115,7 +93,7 @@ def main():
                 if find_res:
                     connect_state = find_res[0]["value_text"]
 
-                (_, stats) = mtsample(0, 1)
+                (_, _, stats) = mtsample(0, 1)
                 inst = stats["inst"]
 
                 if old_inst == inst:
@@ -126,7 +104,7 @@ def main():
                     inst = None
                     start = 0
 
-            (data, stats) = mtsample(start, 100, inst)
+            (body, lines, stats) = mtsample(start, count, inst)
             connect_state = update_connect_state(connect_state, 'Normal')
         except Exception as e:
             line = f"\t{datetime.now().astimezone()}\t:META\t{value_esc(str(e))}\n"
@@ -144,12 +122,9 @@ def main():
 
         inst = stats["inst"]
 
-        dx = [d.AsDict() for d in data]
-        i4c_conn.invoke_url("log", jsondata=dx)
+        post_log(body.encode())
 
-        data_line = [f"{d.sequence}\t{d.timestamp}\t{d.data_id}\t{value_esc(d.value_text)}\t{str(d.value_num)}" 
-                     f"\t{value_esc(d.value_extra)}\t{value_esc(json.dumps(d.value_add))}\n" for d in data]
-        sys.stdout.writelines(data_line)
+        sys.stdout.writelines(f"{line}\n" for line in lines)
 
         start = stats["next"]
         if start > stats["last"]:
@@ -158,6 +133,9 @@ def main():
             else:
                 time.sleep(sleeptime)
 
+    if spool is not None:
+        spool.drain()
+
 
 if __name__ == '__main__':
     main()
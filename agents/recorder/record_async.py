@@ -0,0 +1,188 @@
+"""
+Records several MTConnect agents from one process.
+
+Every device has its own fetcher and uploader task, connected by a bounded queue. The fetcher requests the next
+window as soon as the previous one is queued, so fetching overlaps with uploading. If the API is slow, the queue
+fills up and the fetcher waits, the unsent data stays in the agent's buffer.
+
+USAGE: record_async.py --config <config file> [--profile <profile>]
+
+Config file (yaml):
+    profile: logwriter
+    sleeptime: 0.5          # seconds to wait if there is no new data
+    count: 100              # max items per sample request
+    queue_size: 4           # number of fetched windows waiting for upload, per device
+    spool: spool            # optional directory, data is written here first and uploaded in the background
+    devices:
+      - host: 192.168.1.10:5000
+        device: mill
+      - host: 192.168.1.11:5000
+        device: lathe
+"""
+import sys
+import asyncio
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import yaml
+import mtconnect
+from db_row import value_esc
+import i4c
+from i4c.spool import LogSpool
+from i4c.tools import jsonify
+
+
+class DeviceRecorder:
+    def __init__(self, conn, host, device, *, sleeptime, count, queue_size, spool=None, last_instance=None):
+        if "://" not in host:
+            host = f"http://{host}"
+        self.conn = conn
+        self.host = host
+        self.device = device
+        self.sleeptime = sleeptime
+        self.count = count
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.spool = spool
+        self.last_instance = last_instance
+        self.inst = None
+        self.start = None
+        self.connect_state = None
+
+    def write(self, line):
+        sys.stdout.write(f"{self.device}\t{line}\n")
+
+    async def invoke_url(self, url, **kwargs):
+        return await asyncio.to_thread(self.conn.invoke_url, url, **kwargs)
+
+    async def post_log(self, body: bytes):
+        if self.spool is not None:
+            await asyncio.to_thread(self.spool.append, body)
+        else:
+            await self.invoke_url("log", data=body, data_content_type="application/json")
+
+    async def update_connect_state(self, new):
+        if self.connect_state == new:
+            return
+        await self.post_log(jsonify([dict(device=self.device,
+                                          timestamp=datetime.now(),
+                                          sequence=0,
+                                          data_id='connect',
+                                          value_text=new)]).encode())
+        self.connect_state = new
+
+    async def init_state(self):
+        dev = urllib.parse.quote(self.device)
+        old_inst = None
+        # the value prefetched for all devices at startup is used once, a reconnect asks again
+        last_instance_res, self.last_instance = self.last_instance, None
+        if last_instance_res is None:
+            last_instance_res = await self.invoke_url(f"log/last_instance?device={dev}")
+        if last_instance_res:
+            old_inst = last_instance_res["instance"]
+
+        find_res = await self.invoke_url(f"log/find?device={dev}&before_count=1&data_id=connect")
+        if find_res:
+            self.connect_state = find_res[0]["value_text"]
+
+        (_, _, stats) = await asyncio.to_thread(mtconnect.mtsample, self.host, self.device, 0, 1)
+        if old_inst == stats["inst"]:
+            self.inst = old_inst
+            self.start = int(last_instance_res["sequence"]) + 1
+            if self.start < stats["first"]:
+                self.start = 0
+        else:
+            self.inst = None
+            self.start = 0
+
+    async def fetcher(self):
+        initialized = False
+        while True:
+            try:
+                if not initialized:
+                    await self.init_state()
+                    initialized = True
+                (body, lines, stats) = await asyncio.to_thread(mtconnect.mtsample, self.host, self.device,
+                                                               self.start, self.count, self.inst)
+                await self.update_connect_state('Normal')
+            except Exception as e:
+                self.write(f"{datetime.now().astimezone()}\t:META\t{value_esc(str(e))}")
+                try:
+                    await self.update_connect_state('Fault')
+                except Exception as e:
+                    self.write(f"{datetime.now().astimezone()}\t:META\t{value_esc(str(e))}")
+                await asyncio.sleep(self.sleeptime)
+                continue
+
+            if self.inst is not None and self.inst != stats["inst"]:
+                self.start = 0
+                self.inst = stats["inst"]
+                self.write(f"{datetime.now().astimezone()}\t:META\tinstance changed")
+                continue
+
+            self.inst = stats["inst"]
+            if lines:
+                await self.queue.put((body.encode(), lines))
+
+            self.start = stats["next"]
+            if self.start > stats["last"]:
+                await asyncio.sleep(self.sleeptime)
+
+    async def uploader(self):
+        while True:
+            (body, lines) = await self.queue.get()
+            while True:
+                try:
+                    await self.post_log(body)
+                    break
+                except Exception as e:
+                    self.write(f"{datetime.now().astimezone()}\t:META\tupload failed: {value_esc(str(e))}")
+                    await asyncio.sleep(self.sleeptime)
+
+            sys.stdout.writelines(f"{self.device}\t{line}\n" for line in lines)
+
+    async def run(self):
+        await asyncio.gather(self.fetcher(), self.uploader())
+
+
+async def main():
+    opts = {opt: opv for (opt, opv) in zip(sys.argv, sys.argv[1:]) if opt.startswith("--")}
+    if "--config" not in opts:
+        print(f"USAGE: {sys.argv[0]} --config <config file> [--profile <profile>]")
+        raise Exception("Invalid command line config.")
+
+    with open(opts["--config"]) as f:
+        cfg = yaml.load(f, Loader=yaml.FullLoader)
+
+    profile = opts.get("--profile") or cfg.get("profile", None)
+    conn = i4c.I4CConnection(profile=profile)
+
+    devices = cfg.get("devices", [])
+    spool = None
+    if cfg.get("spool"):
+        spool = LogSpool(cfg["spool"], lambda body: conn.invoke_url("log", data=body, data_content_type="application/json"))
+        spool.start_sender(float(cfg.get("sleeptime", 1)))
+    # blocking http calls run in threads: one fetch and one upload per device at most
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * len(devices) + 2))
+
+    last_instances = None
+    if devices:
+        query = urllib.parse.urlencode([("device", d["device"]) for d in devices])
+        try:
+            res = await asyncio.to_thread(conn.invoke_url, f"log/last_instances?{query}")
+            last_instances = {r["device"]: r for r in res or []}
+        except Exception as e:
+            # the recorders ask one by one
+            sys.stdout.write(f"\t{datetime.now().astimezone()}\t:META\t{value_esc(str(e))}\n")
+
+    recorders = [DeviceRecorder(conn, d["host"], d["device"],
+                                sleeptime=float(d.get("sleeptime", cfg.get("sleeptime", 1))),
+                                count=int(d.get("count", cfg.get("count", 100))),
+                                queue_size=int(d.get("queue_size", cfg.get("queue_size", 4))),
+                                spool=spool,
+                                last_instance=last_instances.get(d["device"], {}) if last_instances is not None else None)
+                 for d in devices]
+    await asyncio.gather(*(r.run() for r in recorders))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
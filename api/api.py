@@ -9,6 +9,7 @@ from endpoints import log, users, root, projects, installations, intfiles, \
 import uvicorn
 import common
 import models.roles
+import models.log
 
 app = I4cApi()
 routers = ((root, None),
@@ -69,6 +70,8 @@ async def unicorn_exception_handler(request: Request, exc: I4cServerError):
 @app.on_event("startup")
 async def startup_event():
     await common.DatabaseConnection.init_db_pool()
+    models.log.log_changes.start()
+    await models.log.latest_values.load_all()
 
 
 if __name__ == "__main__":
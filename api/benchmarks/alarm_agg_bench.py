@@ -0,0 +1,76 @@
+"""
+Compares the sample condition aggregation of the alarm check: recalculating the aggregate of the whole window
+for every row, as calc_aggregate does, and RollingAggregate keeping it up to date as the window moves. No
+database is needed.
+
+Run from the api folder:
+    python -m benchmarks.alarm_agg_bench [row_count]
+"""
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+from common.rolling import RollingAggregate
+from models.alarm import AlarmCondSampleAggMethod, AlarmCondSampleAggSlopeKind, calc_aggregate
+
+bench_start = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def make_rows(row_count: int):
+    ts = bench_start
+    rows = []
+    for _ in range(row_count):
+        ts += timedelta(seconds=random.uniform(0.1, 2))
+        rows.append(dict(timestamp=ts, value_num=None if random.random() < 0.05 else random.gauss(60, 5)))
+    return rows
+
+
+def recalculated(rows, method, slope_kind, window_size):
+    res = []
+    for i in range(len(rows)):
+        window = rows[max(0, i - window_size + 1):i + 1]
+        res.append(calc_aggregate(method, window, slope_kind))
+    return res
+
+
+def rolling(rows, method, slope_kind, window_size):
+    res = []
+    stats = RollingAggregate(method, slope_kind)
+    for r in rows:
+        if len(stats) == window_size:
+            stats.pop()
+        stats.push(r["timestamp"].timestamp(), r["value_num"])
+        res.append(stats.value())
+    return res
+
+
+def measure(name, f):
+    t = time.perf_counter()
+    res = f()
+    print(f"{name:24}  {time.perf_counter() - t:9.3f} s")
+    return res
+
+
+def same(a, b):
+    return all((x is None and y is None) or abs(x - y) <= 1e-6 * max(1.0, abs(y)) for x, y in zip(a, b))
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    rows = make_rows(row_count)
+
+    cases = [(method, AlarmCondSampleAggSlopeKind.time) for method in AlarmCondSampleAggMethod] \
+        + [(AlarmCondSampleAggMethod.slope, AlarmCondSampleAggSlopeKind.position)]
+
+    print(f"{row_count} rows")
+    for window_size in (10, 100, 1000):
+        for (method, slope_kind) in cases:
+            name = f"{method.value} by {slope_kind.value}" if method == AlarmCondSampleAggMethod.slope else method.value
+            print(f"{name}, window of {window_size}")
+            ref = measure("  recalculated", lambda: recalculated(rows, method, slope_kind, window_size))
+            assert same(measure("  rolling", lambda: rolling(rows, method, slope_kind, window_size)), ref)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the regular and the streamed GET /log/find for large exports.
+
+The regular path is measured up to the serialized response body, the way FastAPI produces it, the streamed path
+until the last chunk is produced. Test rows are written for the mill device in the year 2000, with their own
+data ids, and removed at the end.
+
+Run from the api folder, against a test database configured in dbconfig.yaml:
+    python -m benchmarks.log_find_bench [row_count]
+"""
+import sys
+import time
+import asyncio
+import os
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+from common import DatabaseConnection
+from models.log import DataPointLog, put_log_write_bulk, get_find, get_find_stream, LogFindStream
+
+bench_device = "mill"
+bench_data_ids = [f"bench_{os.getpid()}_{i}" for i in range(10)]
+bench_start = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+async def setup(count: int):
+    async with DatabaseConnection() as conn:
+        await conn.executemany("insert into meta (device, data_id, category) values ($1, $2, 'SAMPLE')",
+                               [(bench_device, d) for d in bench_data_ids])
+    for first in range(0, count, 10000):
+        batch = [DataPointLog(device=bench_device, instance="bench", timestamp=bench_start + timedelta(milliseconds=i),
+                              sequence=i, data_id=bench_data_ids[i % len(bench_data_ids)],
+                              value_num=float(i), value_text=None, value_extra=None, value_add={"i": i})
+                 for i in range(first, min(first + 10000, count))]
+        await put_log_write_bulk(None, batch)
+
+
+async def cleanup():
+    async with DatabaseConnection() as conn:
+        await conn.execute("delete from log where device = $1 and data_id = any($2)", bench_device, bench_data_ids)
+        await conn.execute("delete from meta where device = $1 and data_id = any($2)", bench_device, bench_data_ids)
+
+
+async def run_regular(count: int):
+    rs = await get_find(None, bench_device, bench_start, None, None, count)
+    return len(JSONResponse(jsonable_encoder(rs)).body)
+
+
+async def run_stream(count: int, fmt: LogFindStream):
+    size = 0
+    async for chunk in get_find_stream(None, bench_device, bench_start, None, None, count, fmt=fmt):
+        size += len(chunk)
+    return size
+
+
+async def measure(name, f):
+    t = time.perf_counter()
+    size = await f()
+    elapsed = time.perf_counter() - t
+    tracemalloc.start()
+    await f()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:14}  {elapsed:8.2f} s   {size / 1024 / 1024:8.1f} MB response   {peak / 1024 / 1024:8.1f} MB peak memory")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    await DatabaseConnection.init_db_pool()
+    await setup(count)
+    try:
+        await measure("regular", lambda: run_regular(count))
+        await measure("stream json", lambda: run_stream(count, LogFindStream.json))
+        await measure("stream ndjson", lambda: run_stream(count, LogFindStream.ndjson))
+    finally:
+        await cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
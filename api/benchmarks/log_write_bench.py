@@ -0,0 +1,49 @@
+"""
+Compares the row by row and the bulk (COPY based) log write path.
+
+Run from the api folder, against a test database configured in dbconfig.yaml:
+    python -m benchmarks.log_write_bench [batch_size] [batch_count]
+"""
+import sys
+import time
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from common import DatabaseConnection
+from models.log import DataPointLog, put_log_write
+
+bench_device = f"bench_{os.getpid()}"
+
+
+def make_batch(start: datetime, first_seq: int, size: int):
+    return [DataPointLog(device=bench_device, instance="bench", timestamp=start + timedelta(milliseconds=i),
+                         sequence=first_seq + i, data_id=f"d{i % 10}",
+                         value_num=float(i), value_text=None, value_extra=None, value_add={"i": i})
+            for i in range(size)]
+
+
+async def run(bulk: bool, batch_size: int, batch_count: int, *, override=False):
+    start = datetime.now(timezone.utc)
+    batches = [make_batch(start + timedelta(seconds=b), b * batch_size, batch_size) for b in range(batch_count)]
+    t = time.perf_counter()
+    for batch in batches:
+        await put_log_write(None, batch, override=override, bulk=bulk)
+    elapsed = time.perf_counter() - t
+    async with DatabaseConnection() as conn:
+        await conn.execute("delete from log where device = $1", bench_device)
+    return batch_size * batch_count / elapsed
+
+
+async def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    batch_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    await DatabaseConnection.init_db_pool()
+    for override in (False, True):
+        row = await run(False, batch_size, batch_count, override=override)
+        bulk = await run(True, batch_size, batch_count, override=override)
+        print(f"override={override!s:5}  row by row: {row:10.0f} rows/s   bulk: {bulk:10.0f} rows/s   "
+              f"x{bulk / row:.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Compares the point membership checks of Series: the former linear scan, the binary search, the merge pass
+of timestamps_in, and IntervalSet.contains. No database is needed.
+
+The linear scan is measured on a part of the samples only, and scaled up.
+
+Run from the api folder:
+    python -m benchmarks.series_membership_bench [sample_count] [interval_count]
+"""
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+from common.series_intersect import Series, TimePeriod
+from common.interval_set import IntervalSet, to_us_array
+
+bench_start = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def make_series(interval_count: int, span: timedelta) -> Series:
+    step = span / interval_count
+    s = Series()
+    for i in range(interval_count):
+        start = bench_start + i * step
+        s.add(TimePeriod(start, start + step * random.uniform(0.1, 0.9)))
+    return s
+
+
+def make_samples(sample_count: int, span: timedelta):
+    return sorted(bench_start + span * random.random() for _ in range(sample_count))
+
+
+def linear(s: Series, p):
+    for i in s:
+        if i.is_timestamp_in(p):
+            return True
+    return False
+
+
+def measure(name, f, scale=1):
+    t = time.perf_counter()
+    res = f()
+    elapsed = (time.perf_counter() - t) * scale
+    print(f"{name:22}  {elapsed:9.3f} s{'  (scaled)' if scale != 1 else ''}")
+    return res
+
+
+def main():
+    sample_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    interval_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    random.seed(0)
+    span = timedelta(days=30)
+    s = make_series(interval_count, span)
+    samples = make_samples(sample_count, span)
+    linear_count = min(sample_count, 1000)
+
+    print(f"{sample_count} samples, {interval_count} intervals")
+    ref = measure("linear scan", lambda: [linear(s, p) for p in samples[:linear_count]], sample_count / linear_count)
+    res = measure("binary search", lambda: [s.is_timestamp_in(p) for p in samples])
+    assert res[:linear_count] == ref
+    assert measure("merge pass", lambda: s.timestamps_in(samples)) == res
+    iset = measure("IntervalSet build", lambda: IntervalSet.from_series(s))
+    us = measure("timestamp conversion", lambda: to_us_array(samples))
+    assert measure("IntervalSet.contains", lambda: iset.contains(us)).tolist() == res
+
+
+if __name__ == '__main__':
+    main()
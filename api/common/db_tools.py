@@ -1,6 +1,7 @@
 from typing import Dict, Set, Any, List, Union
 from common import DatabaseConnection
 import json
+import weakref
 
 
 async def get_user_customer(user_id, *, pconn=None):
@@ -26,3 +27,34 @@ def asyncpg_row_process_json(d: Dict[str,Any], json_fields: Union[str, Set[str]]
 
 def asyncpg_rows_process_json(l: List[Dict[str,Any]], json_fields: Union[str, Set[str]]):
     return [asyncpg_row_process_json(r, json_fields) for r in l]
+
+
+class StatementStats:
+    """
+    Counts how many times a statement was run on a connection that already prepared it.
+
+    The prepared statements are kept by the asyncpg statement cache of each connection, keyed by the sql text.
+    PreparedStatement objects can not be kept, asyncpg invalidates them when the connection goes back to the
+    pool, but the cache survives. So for a query to be prepared only once per connection, its sql text must
+    only depend on the shape of the query, and all the values must be parameters.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.statements = set()
+        self._prepared = weakref.WeakKeyDictionary()
+
+    def record(self, conn, sql):
+        # pool connections are proxies, a new one for every acquire
+        con = getattr(conn, "_con", None) or conn
+        prepared = self._prepared.setdefault(con, set())
+        if sql in prepared:
+            self.hits += 1
+        else:
+            self.misses += 1
+            prepared.add(sql)
+            self.statements.add(sql)
+
+    def connections(self):
+        return len(self._prepared)
@@ -23,6 +23,8 @@ def param2sql_str(p):
         return "'" + p.replace("'", "''") + "'"
     if isinstance(p, datetime):
         return "'" + str(p) + "'"
+    if isinstance(p, (list, tuple)):
+        return "array[" + ", ".join(param2sql_str(x) for x in p) + "]"
     return str(p)
 
 
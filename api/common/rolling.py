@@ -0,0 +1,99 @@
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Optional
+from common.tools import frac_index
+
+order_methods = ("median", "q1st", "q4th")
+
+
+class RollingAggregate:
+    """
+    Aggregate over a sliding window of samples. Samples are pushed at the end and popped from the start, the
+    aggregate is kept up to date on the way: running sums for avg and slope, a sorted list for the order
+    statistics. None values take place in the window but not in the aggregate.
+
+    Methods: avg, median, q1st and q4th (1st and 4th quintiles) and slope (linear regression). The
+    x of the slope is given with the samples, or if slope_x is "position", it is the position of the sample
+    among the ones with a value.
+    """
+    def __init__(self, method: str, slope_x: str = "time"):
+        self.method = method
+        self.slope_x = slope_x
+        self.samples = deque()  # (x, value)
+        self.sorted = []
+        self.position = 0
+        self._reset_sums(0.0)
+
+    def _reset_sums(self, origin):
+        # sums are kept relative to origin, and rebuilt once the window moved on by its size, so they do not
+        # cancel out over large x values or accumulate rounding errors
+        self.origin = origin
+        self.since_rebase = 0
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+        for x, y in self.samples:
+            if y is not None:
+                self._add_sums(x, y, 1)
+
+    def _add_sums(self, x, y, sign):
+        self.n += sign
+        self.sy += sign * y
+        if self.method == "slope":
+            x -= self.origin
+            self.sx += sign * x
+            self.sxx += sign * x * x
+            self.sxy += sign * x * y
+
+    def __len__(self):
+        return len(self.samples)
+
+    def first_x(self):
+        return self.samples[0][0]
+
+    def push(self, x, value: Optional[float]):
+        if value is not None and self.slope_x == "position":
+            x = self.position
+            self.position += 1
+        if value is not None:
+            if self.method in order_methods:
+                insort(self.sorted, value)
+            else:
+                if self.n == 0:
+                    self._reset_sums(x)
+                self._add_sums(x, value, 1)
+        self.samples.append((x, value))
+
+    def pop(self):
+        x, value = self.samples.popleft()
+        if value is None:
+            return
+        if self.method in order_methods:
+            del self.sorted[bisect_left(self.sorted, value)]
+        else:
+            self._add_sums(x, value, -1)
+            self.since_rebase += 1
+            if self.since_rebase >= len(self.samples):
+                first = next((x for x, v in self.samples if v is not None), 0.0)
+                self._reset_sums(first)
+
+    def value(self) -> Optional[float]:
+        if self.method in order_methods:
+            o = self.sorted
+            if not o:
+                return None
+            if self.method == "median":
+                return frac_index(o, (len(o) - 1) / 2)
+            elif self.method == "q1st":
+                return frac_index(o, (len(o) - 1) / 5)
+            else:
+                return frac_index(o, (len(o) - 1) * 4 / 5)
+        if self.n == 0:
+            return None
+        if self.method == "avg":
+            return self.sy / self.n
+        if self.method == "slope":
+            if self.n == 1:
+                return 0
+            # https://www.statisticshowto.com/probability-and-statistics/regression-analysis/find-a-linear-regression-equation/
+            return (self.n * self.sxy - self.sx * self.sy) / (self.n * self.sxx - self.sx ** 2)
+        return None
@@ -1,5 +1,6 @@
+import heapq
 from datetime import datetime
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Iterable
 
 
 class TimePeriod:
@@ -32,6 +33,19 @@ class TimePeriod:
         return True
 
 
+def default_merge_extra(x, y):
+    if x is None:
+        return y
+    if y is None:
+        return x
+    return "\n".join((x, y))
+
+
+def starts_before(start: Optional[datetime], p: Optional[datetime]):
+    """ start <= p, start = None => -inf, p = None => -inf """
+    return start is None or (p is not None and start <= p)
+
+
 class SeriesIterator:
     """
     :type _s: Series
@@ -118,68 +132,139 @@ class Series:
         :type merge_extra
         :rtype Series
         """
+        return Series.intersect_all((s1, s2), merge_extra)
+
+    @staticmethod
+    def _boundaries(series, ends_first):
+        """
+        Yields (p, entering, series index, item) for the starts and ends of the items of all the series, in time
+        order, using a heap with one pending boundary per series. Open starts come first with p = None, open
+        ends are not yielded. At the same p ends come before starts if ends_first, after them otherwise.
+        """
+        start_order, end_order = (1, 0) if ends_first else (0, 1)
+        heap = []
+        for idx, s in enumerate(series):
+            if len(s._items) == 0:
+                continue
+            item = s._items[0]
+            if item.start is None:
+                yield None, True, idx, item
+                if item.end is not None:
+                    heap.append((item.end, end_order, idx, 0))
+            else:
+                heap.append((item.start, start_order, idx, 0))
+        heapq.heapify(heap)
+        while heap:
+            p, order, idx, pos = heapq.heappop(heap)
+            items = series[idx]._items
+            if order == start_order:
+                yield p, True, idx, items[pos]
+                if items[pos].end is not None:
+                    heapq.heappush(heap, (items[pos].end, end_order, idx, pos))
+            else:
+                yield p, False, idx, items[pos]
+                if pos + 1 < len(items):
+                    heapq.heappush(heap, (items[pos + 1].start, start_order, idx, pos + 1))
+
+    @staticmethod
+    def intersect_all(series, merge_extra=None):
+        """
+        Intersection of any number of series in one sweep. The extra of a result item is merge_extra folded
+        over the extras of the covering items in the order of the series, the same as pairwise intersect gives.
+        :type series: Iterable[Series]
+        :rtype Series
+        """
+        series = list(series)
         res = Series()
-        if len(s1._items) == 0 or len(s2._items) == 0:
+        if len(series) == 0 or any(len(s._items) == 0 for s in series):
             return res
-
         if merge_extra is None:
-            def merge_extra(x,y):
-                if x is None:
-                    return y
-                if y is None:
-                    return x
-                return "\n".join((x,y))
-
-        i1, i2 = 0,0
-        item1 = s1._items[i1]  # type: TimePeriod
-        item2 = s2._items[i2]  # type: TimePeriod
-
-        p = None if item1.start is None and item2.start is None else \
-            item1.start if item2.start is None else \
-            item2.start if item1.start is None else \
-            min(item1.start, item2.start)
+            merge_extra = default_merge_extra
 
+        # the items of a series are disjunct and do not touch, so p is in all the series if this many items cover it
+        count = 0
+        current = [None] * len(series)
         intervall_start = None
         intervall_extra = None
-        intervall_started = False
-        while True:
-            item1 = s1._items[i1]  # type: TimePeriod
-            item2 = s2._items[i2]  # type: TimePeriod
-
-            if item1.is_timestamp_in(p) and item2.is_timestamp_in(p):
-                if not intervall_started:
-                    intervall_started = True
-                    intervall_extra = merge_extra(item1.extra, item2.extra)
+        for p, entering, idx, item in Series._boundaries(series, ends_first=True):
+            if entering:
+                count += 1
+                current[idx] = item
+                if count == len(series):
                     intervall_start = p
+                    intervall_extra = current[0].extra
+                    for i in current[1:]:
+                        intervall_extra = merge_extra(intervall_extra, i.extra)
             else:
-                if intervall_started:
+                if count == len(series):
                     res._items.append(TimePeriod(intervall_start, p, intervall_extra))
-                    intervall_started = False
-
-            if item1.end == p:
-                i1 += 1
-            if item2.end == p:
-                i2 += 1
-
-            if i1 == len(s1._items):
-                break
-            if i2 == len(s2._items):
-                break
-
-            item1 = s1._items[i1]  # type: TimePeriod
-            item2 = s2._items[i2]  # type: TimePeriod
+                count -= 1
+                if item is series[idx]._items[-1]:
+                    # one of the series is over
+                    return res
+        res._items.append(TimePeriod(intervall_start, None, intervall_extra))
+        return res
 
-            p = min((i for i in (item1.start, item1.end, item2.start, item2.end) if i is not None and (p is None or i > p)), default=None)
-            if p is None:
-                break
+    @staticmethod
+    def union_all(series, merge_extra=None):
+        """
+        Union of any number of series in one sweep. Overlapping or touching items are joined, the extra of a
+        result item is merge_extra folded over the extras of the joined items, in the order of their starts.
+        :type series: Iterable[Series]
+        :rtype Series
+        """
+        series = list(series)
+        res = Series()
+        if merge_extra is None:
+            merge_extra = default_merge_extra
 
-        if intervall_started:
+        count = 0
+        intervall_start = None
+        intervall_extra = None
+        for p, entering, idx, item in Series._boundaries(series, ends_first=False):
+            if entering:
+                if count == 0:
+                    intervall_start = p
+                    intervall_extra = item.extra
+                else:
+                    intervall_extra = merge_extra(intervall_extra, item.extra)
+                count += 1
+            else:
+                count -= 1
+                if count == 0:
+                    res._items.append(TimePeriod(intervall_start, p, intervall_extra))
+        if count > 0:
             res._items.append(TimePeriod(intervall_start, None, intervall_extra))
         return res
 
+    def _index_of(self, p: Optional[datetime]):
+        """ index of the last item starting at or before p, -1 if there is none. p = None => p = -inf """
+        lo, hi = 0, len(self._items)
+        while lo < hi:
+            m = (lo + hi) // 2
+            if starts_before(self._items[m].start, p):
+                lo = m + 1
+            else:
+                hi = m
+        return lo - 1
+
     def is_timestamp_in(self,p: Optional[datetime]):
         """ p = None => p = -inf """
-        for i in self._items:
-            if i.is_timestamp_in(p):
-                return True
-        return False
+        idx = self._index_of(p)
+        return idx >= 0 and self._items[idx].is_timestamp_in(p)
+
+    def timestamps_in(self, timestamps: Iterable[Optional[datetime]]) -> List[bool]:
+        """
+        is_timestamp_in for many timestamps. Ascending timestamps are checked in one merge pass with the items,
+        one going backwards is looked up with a binary search. p = None => p = -inf
+        """
+        items = self._items
+        res = []
+        idx = 0
+        for p in timestamps:
+            if idx > 0 and not starts_before(items[idx].start, p):
+                idx = max(self._index_of(p), 0)
+            while idx + 1 < len(items) and starts_before(items[idx + 1].start, p):
+                idx += 1
+            res.append(len(items) > 0 and items[idx].is_timestamp_in(p))
+        return res
@@ -0,0 +1,2 @@
+insert into role_grant values ('admin', 'post/log/stream', array[]::varchar[]);
+insert into role_grant values ('logwriter', 'post/log/stream', array[]::varchar[]);
@@ -0,0 +1,130 @@
+-- Converts the log table to monthly range partitions on "timestamp". Requires PostgreSQL 12 or later.
+-- Partition boundaries are UTC months, partitions are named log_YYYYMM. Rows outside of the created partitions
+-- go to log_default, log_create_partition moves them to their partition once it is created.
+-- Future partitions are created, old ones are detached by log_partition.py in the api folder.
+-- db_create.sql creates the log partitioned, on such a database only the functions are (re)created.
+
+-- Creates the partition of the month of p_month. Rows of the month in the default partition are moved to it.
+create or replace function log_create_partition(p_month date) returns text
+language plpgsql as $$
+declare
+  v_start date := date_trunc('month', p_month)::date;
+  v_name text := 'log_' || to_char(v_start, 'YYYYMM');
+  v_from timestamptz := v_start::timestamp at time zone 'UTC';
+  v_to timestamptz := (v_start + interval '1 month')::timestamp at time zone 'UTC';
+begin
+  if to_regclass(v_name) is null then
+    execute format('create table %I (like log including defaults)', v_name);
+    if to_regclass('log_default') is not null then
+      execute format('with m as (delete from log_default where "timestamp" >= %L and "timestamp" < %L returning *) '
+                     'insert into %I select * from m',
+                     v_from, v_to, v_name);
+    end if;
+    execute format('alter table log attach partition %I for values from (%L) to (%L)', v_name, v_from, v_to);
+  end if;
+  return v_name;
+end $$;
+
+
+create or replace function log_create_partitions(p_from date, p_to date) returns setof text
+language plpgsql as $$
+declare
+  v_month date := date_trunc('month', p_from)::date;
+begin
+  while v_month <= p_to loop
+    return next log_create_partition(v_month);
+    v_month := (v_month + interval '1 month')::date;
+  end loop;
+end $$;
+
+
+-- Detaches the partitions that end before p_before. Detached partitions are moved to the p_archive_schema
+-- schema, or dropped if it is null.
+create or replace function log_detach_partitions(p_before date, p_archive_schema text) returns setof text
+language plpgsql as $$
+declare
+  r record;
+begin
+  if p_archive_schema is not null then
+    execute format('create schema if not exists %I', p_archive_schema);
+  end if;
+  for r in
+    select c.relname
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where
+      i.inhparent = 'log'::regclass
+      and c.relname ~ '^log_[0-9]{6}$'
+      and to_date(substr(c.relname, 5), 'YYYYMM') + interval '1 month' <= p_before
+    order by c.relname
+  loop
+    execute format('alter table log detach partition %I', r.relname);
+    if p_archive_schema is not null then
+      execute format('alter table %I set schema %I', r.relname, p_archive_schema);
+    else
+      execute format('drop table %I', r.relname);
+    end if;
+    return next r.relname;
+  end loop;
+end $$;
+
+
+do $$
+declare
+  v_unique boolean;
+begin
+  if (select relkind from pg_class where oid = 'log'::regclass) = 'p' then
+    return;
+  end if;
+
+  -- idx_ts_wo_device is unique on some installs, not on others, it is kept as it was
+  select indisunique into v_unique from pg_index where indexrelid = 'idx_ts_wo_device'::regclass;
+
+  alter table log rename to log_unpartitioned;
+  alter index idx_ts rename to idx_ts_unpartitioned;
+  alter index idx_dts rename to idx_dts_unpartitioned;
+  alter index idx_ts_wo_device rename to idx_ts_wo_device_unpartitioned;
+  alter index idx_dts_wo_device rename to idx_dts_wo_device_unpartitioned;
+
+  CREATE TABLE log
+  (
+      device character varying(200) NOT NULL,
+      instance character varying(200),
+      "timestamp" timestamp with time zone NOT NULL,
+      sequence integer NOT NULL,
+      data_id character varying(200) NOT NULL,
+      value_num double precision,
+      value_text character varying(200),
+      value_extra character varying(200),
+      value_aux json
+  ) PARTITION BY RANGE ("timestamp");
+
+  GRANT ALL ON TABLE log TO i4capi;
+
+  CREATE UNIQUE INDEX idx_ts
+      ON log USING btree
+      (device ASC NULLS LAST, "timestamp" ASC NULLS LAST, sequence ASC NULLS LAST);
+
+  CREATE INDEX idx_dts
+      ON log USING btree
+      (device ASC NULLS LAST, data_id ASC NULLS LAST, "timestamp" ASC NULLS LAST, sequence ASC NULLS LAST);
+
+  -- the partition key is part of it, so it can stay unique
+  execute format('CREATE %s INDEX idx_ts_wo_device ON log USING btree ("timestamp" ASC NULLS LAST, sequence ASC NULLS LAST)',
+                 case when v_unique then 'UNIQUE' else '' end);
+
+  CREATE INDEX idx_dts_wo_device
+      ON log USING btree
+      (data_id ASC NULLS LAST, "timestamp" ASC NULLS LAST, sequence ASC NULLS LAST);
+
+  create table log_default partition of log default;
+
+  perform log_create_partitions(
+    (coalesce((select min("timestamp") from log_unpartitioned), now()) at time zone 'UTC')::date,
+    ((now() + interval '3 months') at time zone 'UTC')::date);
+
+  insert into log
+  select * from log_unpartitioned;
+
+  -- drop table log_unpartitioned;
+end $$;
@@ -0,0 +1 @@
+insert into role_grant values ('admin', 'get/log/find_stats', array[]::varchar[]);
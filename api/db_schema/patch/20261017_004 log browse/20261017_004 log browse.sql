@@ -0,0 +1,2 @@
+insert into role_grant values ('admin', 'get/log/browse', array[]::varchar[]);
+insert into role_grant values ('power_user', 'get/log/browse', array[]::varchar[]);
@@ -0,0 +1,2 @@
+insert into role_grant values ('admin', 'get/log/snapshot/live', array[]::varchar[]);
+insert into role_grant values ('power_user', 'get/log/snapshot/live', array[]::varchar[]);
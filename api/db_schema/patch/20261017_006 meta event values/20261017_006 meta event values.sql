@@ -0,0 +1,23 @@
+-- Catalogue of the distinct values of the EVENT data types, read by /log/meta instead of scanning the log.
+-- The log write path keeps it up to date, last_seen is the latest timestamp the value was logged with.
+
+CREATE TABLE meta_event_value
+(
+    device character varying(200) NOT NULL,
+    data_id character varying(200) NOT NULL,
+    value character varying(200) NOT NULL,
+    last_seen timestamp with time zone NOT NULL,
+    CONSTRAINT meta_event_value_pkey PRIMARY KEY (device, data_id, value)
+);
+
+GRANT ALL ON TABLE meta_event_value TO i4capi;
+
+insert into meta_event_value (device, data_id, value, last_seen)
+select l.device, l.data_id, l.value_text, max(l."timestamp")
+from meta m
+join log l on l.device = m.device and l.data_id = m.data_id
+where
+  l."timestamp" >= current_date - 90
+  and m.category = 'EVENT'
+  and l.value_text is not null
+group by l.device, l.data_id, l.value_text;
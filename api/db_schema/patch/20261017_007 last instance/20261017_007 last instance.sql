@@ -0,0 +1,11 @@
+-- Partial covering index for the last instance lookup of the recorders. Only the rows with an instance are
+-- indexed, in the order of the lookup, and the instance is included, so it is a short index only scan.
+
+CREATE INDEX idx_instance
+    ON log USING btree
+    (device ASC NULLS LAST, "timestamp" DESC NULLS LAST, sequence DESC NULLS LAST)
+    INCLUDE (instance)
+    WHERE instance IS NOT NULL;
+
+insert into role_grant values ('admin', 'get/log/last_instances', array[]::varchar[]);
+insert into role_grant values ('logwriter', 'get/log/last_instances', array[]::varchar[]);
@@ -0,0 +1 @@
+insert into role_grant values ('admin', 'delete/log', array[]::varchar[]);
@@ -0,0 +1,30 @@
+-- Checkpoints of the incremental alarm check, one row per condition. A row is valid only if its last_check
+-- equals the last_check of the alarm, so changing the alarm definition invalidates it.
+
+create table alarm_cond_state (
+    cond integer not null constraint pk_alarm_cond_state primary key
+        constraint fk_alarm_cond_state_cond references alarm_cond on delete cascade,
+    last_check timestamp with time zone not null,
+    "timestamp" timestamp with time zone not null,
+    sequence integer not null,
+    value_num double precision null,
+    value_text character varying (200) null,
+    in_total boolean not null,
+    agg_pos bigint null
+);
+
+GRANT ALL ON TABLE alarm_cond_state TO i4capi;
+
+-- The aggregation window of the sample conditions, the rows numbered in the order they entered it. The window
+-- of a checkpoint are the rows from its agg_pos.
+
+create table alarm_cond_state_agg (
+    cond integer not null
+        constraint fk_alarm_cond_state_agg_cond references alarm_cond_state on delete cascade,
+    pos bigint not null,
+    "timestamp" timestamp with time zone not null,
+    value_num double precision null,
+    constraint pk_alarm_cond_state_agg primary key (cond, pos)
+);
+
+GRANT ALL ON TABLE alarm_cond_state_agg TO i4capi;
@@ -186,10 +186,23 @@ async def check_alarmevent(
     credentials: HTTPBasicCredentials = Depends(common.security_checker("post/alarm/events/check", ask_features=['noaudit'])),
     alarm: Optional[str] = Query(None, title="Only check this alarm."),
     max_count: Optional[int] = Query(None, title="Stop after creating this many events."),
-    noaudit: Optional[bool] = Query(False, title="Don't write audit record. Requires special privilege.")
+    noaudit: Optional[bool] = Query(False, title="Don't write audit record. Requires special privilege."),
+    incremental: Optional[bool] = Query(False, title="Continue from the previous check, only load new log rows."),
+    parallel: Optional[bool] = Query(False, title="Check several alarms at the same time, each in its own transaction."),
+    wait: Optional[float] = Query(None, title="Wait at most this many seconds for log writes, and only check the alarms watching the written data.")
 ):
-    """Check alarms and create events if an alarm state is detected."""
-    return await models.alarm.check_alarmevent(credentials, alarm, max_count)
+    """
+    Check alarms and create events if an alarm state is detected. In incremental mode the state of the conditions
+    is kept between checks, sample conditions aggregate over the rows of the previous checks too, so near the start
+    of a check their values can differ from a full check, which starts aggregating anew. In parallel mode
+    the alarms are checked on several connections, and each alarm's events are committed separately.
+
+    With wait, the check is driven by the log writes: it returns after the alarms watching the newly written data
+    are checked. If nothing was written, and at least every wait seconds, all alarms are checked, for the
+    conditions that depend on time only.
+    """
+    return await models.alarm.check_alarmevent(credentials, alarm, max_count, incremental=incremental, parallel=parallel,
+                                               wait=wait)
 
 
 @router.get("/events", response_model=List[models.alarm.AlarmEvent], operation_id="alarm_events",
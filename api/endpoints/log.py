@@ -3,13 +3,14 @@ from typing import Optional, List
 from fastapi import Depends, Query, Body
 from fastapi.security import HTTPBasicCredentials
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 import models.log
 import common
 from I4cAPI import I4cApiRouter
 from common.exceptions import I4cClientNotFound
 from models import Device, DeviceAuto
-from models.log.find import LogCondEventRel
+from models.log.find import LogCondEventRel, LogFindStream
+from models.log.browse import LogBrowseDirection
 
 router = I4cApiRouter(include_path="/log")
 
@@ -26,6 +27,25 @@ async def snapshot(
     return await models.log.get_snapshot(credentials, ts, device)
 
 
+__oa_sse = {"responses": {"200": {"content": {"text/event-stream": {"schema": {"type": "string"}}}}}}
+
+@router.get("/snapshot/live", response_class=StreamingResponse, operation_id="log_snapshot_live",
+            summary="Live snapshot of a device.", allow_log=False, openapi_extra=__oa_sse)
+async def snapshot_live(
+    request: Request,
+    credentials: HTTPBasicCredentials = Depends(common.security_checker("get/log/snapshot/live")),
+    device: Device = Query(..., title="Name of the device.")
+):
+    """
+    Server sent events of the device's snapshot. The first `snapshot` event is the full snapshot, the following
+    `delta` events are json merge patches (RFC 7386) to the previous state. A null in a delta deletes the field;
+    when a field turns null instead, a new `snapshot` event replaces the state. Events are sent when the log of
+    the device changes, all the viewers share the same snapshot query.
+    """
+    return StreamingResponse(models.log.snapshot_hub.subscribe(device), media_type="text/event-stream",
+                             headers={"cache-control": "no-cache"})
+
+
 @router.get("/find", response_model=List[models.log.DataPointDevice], operation_id="log_list", allow_log=False,
             summary="Search the log.")
 async def find(
@@ -40,15 +60,52 @@ async def find(
         data_id: Optional[str] = Query(None, title="Log data type."),
         val: Optional[List[str]] = Query(None, title="Value of the log item."),
         extra: Optional[str] = Query(None, title="Extra of the log item."),
-        rel: Optional[LogCondEventRel] = Query(None, title="Relation for the val or extra.")
+        rel: Optional[LogCondEventRel] = Query(None, title="Relation for the val or extra."),
+        stream: Optional[LogFindStream] = Query(None, title="Stream the result as a json array or as newline delimited json. Use for large counts.")
 ):
     """List log entries."""
+    if stream is not None:
+        rows = models.log.get_find_stream(credentials, device, timestamp, sequence, before_count, after_count, categ,
+                                          data_id, val, extra, rel, fmt=stream)
+        media_type = "application/x-ndjson" if stream == LogFindStream.ndjson else "application/json"
+        return StreamingResponse(rows, media_type=media_type)
     rs = await models.log.get_find(credentials, device, timestamp, sequence, before_count, after_count, categ, data_id, val, extra, rel)
     if rs is None:
         raise I4cClientNotFound("No log record found")
     return rs
 
 
+@router.get("/browse", response_model=models.log.LogPage, operation_id="log_browse", allow_log=False,
+            summary="Browse the log page by page.")
+async def browse(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(common.security_checker("get/log/browse")),
+        device: Device = Query(..., title="Device."),
+        data_id: Optional[str] = Query(None, title="Log data type."),
+        timestamp: Optional[datetime] = Query(None, title="Start of the first page, iso format. Defaults to the end of the log."),
+        direction: LogBrowseDirection = Query(LogBrowseDirection.backward, title="Browse backward or forward in time."),
+        page_size: int = Query(100, title="Number of log records on a page."),
+        token: Optional[str] = Query(None, title="Continuation token from the previous page. Replaces data_id, timestamp and direction.")
+):
+    """
+    List log entries page by page. Each page returns a token for the next one, and every page takes about
+    the same time, no matter how deep the browsing goes.
+    """
+    return await models.log.get_browse(credentials, device, data_id, timestamp, direction, page_size, token)
+
+
+@router.get("/find_stats", response_model=models.log.LogFindStats, operation_id="log_find_stats",
+            summary="Statement reuse of the log search.")
+async def find_stats(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(common.security_checker("get/log/find_stats"))):
+    """
+    Counts how many log searches could use a statement already prepared on the database connection, since
+    the server started.
+    """
+    return await models.log.get_find_stats(credentials)
+
+
 @router.get("/meta", response_model=List[models.log.Meta], operation_id="log_meta", summary="Get log metadata.")
 async def meta(
         request: Request,
@@ -66,6 +123,36 @@ async def log_write(
     await models.log.put_log_write(credentials, datapoints)
 
 
+__oa_ndjson = {"requestBody": {"content": {"application/x-ndjson": {"schema": {"title": "Data", "type": "string", "format": "binary"}}}}}
+
+# the disconnect guard would consume the request body, so it is turned off
+@router.post("/stream", response_model=models.log.LogWriteStreamResult, operation_id="log_write_stream",
+             allow_log=False, disconnect_guard=False, summary="Write log from a stream.", openapi_extra=__oa_ndjson)
+async def log_write_stream(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(common.security_checker("post/log/stream")),
+        chunk_size: Optional[int] = Query(None, title="Number of rows written in one transaction.")):
+    """
+    Submit data to the log as newline delimited json, one data point per line. Rows are written in chunks,
+    the number of rows written is reported per chunk.
+    """
+    return await models.log.put_log_write_stream(credentials, request.stream(), chunk_size=chunk_size)
+
+
+@router.delete("", response_model=models.log.LogDeleteResult, operation_id="log_delete",
+               summary="Delete log rows.")
+async def log_delete(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(common.security_checker("delete/log")),
+        selection: models.log.LogDelete = Body(...),
+        chunk_size: Optional[int] = Query(None, title="Number of rows deleted in one statement.")):
+    """
+    Delete a list of log rows by their keys, or all rows of a device in a time range, optionally restricted
+    to some data types. Rows are deleted in chunks, the number of rows deleted is reported per chunk.
+    """
+    return await models.log.delete_log_bulk(credentials, selection, chunk_size=chunk_size)
+
+
 @router.get("/last_instance", response_model=models.log.LastInstance, operation_id="log_lastinstance",
             summary="Last known instance of a device.")
 async def last_instance(
@@ -74,3 +161,13 @@ async def last_instance(
         device: Device = Query(..., title="Device.")):
     """For Mazak machines, the last seen MTConnect instance. Can be used to determine if we need to query back data."""
     return await models.log.get_last_instance(credentials, device)
+
+
+@router.get("/last_instances", response_model=List[models.log.LastInstanceDevice], operation_id="log_lastinstances",
+            summary="Last known instance of several devices.")
+async def last_instances(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(common.security_checker("get/log/last_instances")),
+        device: List[Device] = Query(..., title="Devices.")):
+    """Same as last_instance, for many devices at once. Devices without a known instance are left out."""
+    return await models.log.get_last_instances(credentials, device)
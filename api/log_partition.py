@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Log partition maintenance. Creates the monthly log partitions ahead of time, and detaches the ones older than
+the retention period. Schedule it to run daily, with a database user that owns the log table.
+
+usage: python log_partition.py [--ahead <months>] [--retention <months>] [--archive-schema <schema> | --drop]
+
+Defaults are taken from the log_partition section of apiconfig.yaml. Without retention, nothing is detached.
+Detached partitions are moved to the archive schema (log_archive by default), or dropped if --drop is given.
+"""
+import sys
+import asyncio
+from datetime import date
+from common import DatabaseConnection, apicfg, log
+
+
+def add_months(d: date, months: int) -> date:
+    m = d.year * 12 + d.month - 1 + months
+    return date(m // 12, m % 12 + 1, 1)
+
+
+async def maintain(ahead: int, retention, archive_schema):
+    today = date.today()
+    async with DatabaseConnection() as conn:
+        async with conn.transaction():
+            rs = await conn.fetch("select log_create_partitions($1, $2)", today, add_months(today, ahead))
+            log.info(f"log partitions present: {', '.join(r[0] for r in rs)}")
+            if await conn.fetchval("select exists (select 1 from log_default)"):
+                log.warning("log rows outside of the partitions are in log_default, create the partitions of their months")
+            if retention is not None:
+                before = add_months(today, -retention)
+                rs = await conn.fetch("select log_detach_partitions($1, $2)", before, archive_schema)
+                for r in rs:
+                    log.info(f"log partition detached: {r[0]}" + (f" (archived to {archive_schema})" if archive_schema else ""))
+
+
+async def main():
+    opts = {opt: opv for (opt, opv) in zip(sys.argv, sys.argv[1:] + [None]) if opt.startswith("--")}
+    cfg = apicfg.get("log_partition", None) or {}
+
+    ahead = int(opts.get("--ahead") or cfg.get("ahead", 3))
+    retention = opts.get("--retention") or cfg.get("retention", None)
+    retention = int(retention) if retention is not None else None
+    archive_schema = None if "--drop" in opts else opts.get("--archive-schema") or cfg.get("archive_schema", "log_archive")
+
+    await DatabaseConnection.init_db_pool()
+    await maintain(ahead, retention, archive_schema)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
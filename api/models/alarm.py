@@ -1,4 +1,6 @@
+import asyncio
 import textwrap
+from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum
 from textwrap import dedent
@@ -8,10 +10,16 @@ import common.db_helpers
 from common.exceptions import I4cClientError
 from common.debug_helpers import debug_print
 from common.exceptions import I4cInputValidationError, I4cClientNotFound
-from common import I4cBaseModel, DatabaseConnection, write_debug_sql, series_intersect
+from common import I4cBaseModel, DatabaseConnection, write_debug_sql, series_intersect, apicfg
 from common.tools import frac_index
+from common.rolling import RollingAggregate
 from models import CommonStatusEnum, CondEventRel
-from models.common import PatchResponse, series_check_load_sql, check_rel, prev_iterator
+from models.common import PatchResponse, series_check_load_sql, series_check_load_after_sql, check_rel, prev_iterator, \
+    SeriesCheckLoader
+from models.alarm_state import AlarmCondState, AlarmState, alarm_states
+from models.alarm_trigger import alarm_trigger
+
+alarm_check_concurrency = int(apicfg.get("alarm_check_concurrency", 4))
 
 
 async def get_alarm_id(conn, name: str):
@@ -872,7 +880,7 @@ def calc_aggregate(method, agg_values, slope_kind: AlarmCondSampleAggSlopeKind):
             return frac_index(o, (len(o) - 1) / 2)
         elif method == AlarmCondSampleAggMethod.q1st:
             return frac_index(o, (len(o) - 1) / 5)
-        elif method == AlarmCondSampleAggMethod.q3th:
+        elif method == AlarmCondSampleAggMethod.q4th:
             return frac_index(o, (len(o) - 1) * 4 / 5)
     elif method == AlarmCondSampleAggMethod.slope:
         n = len(agg_values)
@@ -889,141 +897,393 @@ def calc_aggregate(method, agg_values, slope_kind: AlarmCondSampleAggSlopeKind):
                  / (n * sum(x ** 2 for x in xl) - sum(xl)**2))
 
 
-async def check_alarmevent(credentials, alarm: str, max_count, *, override_last_check=None, override_now=None):
+def condition_series(row_cond, db_series) -> series_intersect.Series:
+    """ Intervals where a condition or event type alarm condition holds, from consecutive log rows. """
+    current_series = series_intersect.Series()
+    for r_series_prev, r_series in prev_iterator(db_series, include_first=False):
+        if row_cond["log_row_category"] == AlarmCondLogRowCategory.condition:
+            if ( row_cond["value_text"] == r_series_prev["value_text"]
+               or (row_cond["value_text"] == AlarmCondConditionValue.abnormal
+                   and r_series_prev["value_text"] in (AlarmCondConditionValue.warning, AlarmCondConditionValue.fault)
+                   )
+                 ):
+                age_min = timedelta(seconds=row_cond["age_min"] if row_cond["age_min"] else 0)
+                if r_series_prev["timestamp"] + age_min < r_series["timestamp"]:
+                    t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min, r_series["timestamp"],
+                                                    f'{row_cond["device"]} {row_cond["data_id"]} {row_cond["value_text"]}'
+                                                    )
+                    current_series.add(t)
+        elif row_cond["log_row_category"] == AlarmCondLogRowCategory.event:
+            if check_rel(row_cond["rel"], row_cond["value_text"], r_series_prev["value_text"]):
+                age_min = timedelta(seconds=row_cond["age_min"] if row_cond["age_min"] and row_cond["age_min"] > 0 else 0)
+                age_max = timedelta(seconds=row_cond["age_max"]) if row_cond["age_max"] else None
+                if r_series_prev["timestamp"] + age_min < r_series["timestamp"]:
+                    if age_max is None or r_series["timestamp"] + age_max > r_series["timestamp"]:
+                        t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min,
+                                                        r_series["timestamp"],
+                                                        f'{row_cond["device"]} {row_cond["data_id"]} '
+                                                        f'{r_series_prev["value_text"]}       ({row_cond["rel"]} {row_cond["value_text"]})')
+                    else:
+                        t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min,
+                                                        r_series_prev["timestamp"] + age_max,
+                                                        f'{row_cond["device"]} {row_cond["data_id"]} '
+                                                        f'{r_series_prev["value_text"]}       ({row_cond["rel"]} {row_cond["value_text"]})')
+                    current_series.add(t)
+    return current_series
+
+
+class SampleAggregator:
+    """
+    Rolling aggregation of a sample type alarm condition. For a pair of consecutive rows, evaluate gives the
+    aggregated value of the window before the first row, and advance moves the window over the first row.
+    first_pos counts the rows that left the window, from first_pos given with agg_values.
+    """
+    def __init__(self, row_cond, agg_values=None, first_pos=0):
+        self.row_cond = row_cond
+        self.agg_values = deque()
+        self.first_pos = first_pos
+        self.stats = RollingAggregate(row_cond["aggregate_method"],
+                                      AlarmCondSampleAggSlopeKind.time if row_cond["aggregate_period"]
+                                      else AlarmCondSampleAggSlopeKind.position)
+        for r in agg_values or ():
+            self._push(r)
+
+    def _push(self, r):
+        self.agg_values.append(r)
+        self.stats.push(r["timestamp"].timestamp(), r["value_num"])
+
+    def _pop(self):
+        self.agg_values.popleft()
+        self.stats.pop()
+        self.first_pos += 1
+
+    def evaluate(self, r_series_prev, r_series):
+        row_cond = self.row_cond
+        agg_values = self.agg_values
+        if row_cond["aggregate_period"]:
+            agg_time_len = (r_series["timestamp"] - agg_values[0]["timestamp"]).total_seconds() if len(agg_values) > 0 else 0
+            if agg_time_len >= row_cond["aggregate_period"]:
+                return self.stats.value()
+        elif row_cond["aggregate_count"]:
+            if len(agg_values) == row_cond["aggregate_count"]:
+                return self.stats.value()
+        return None
+
+    def advance(self, r_series_prev, r_series):
+        row_cond = self.row_cond
+        agg_values = self.agg_values
+        if row_cond["aggregate_period"]:
+            self._push(r_series_prev)
+            while len(agg_values) > 0 \
+                    and (r_series["timestamp"] - agg_values[0]["timestamp"]).total_seconds() > row_cond["aggregate_period"]:
+                self._pop()
+        elif row_cond["aggregate_count"]:
+            if len(agg_values) == row_cond["aggregate_count"]:
+                self._pop()
+            self._push(r_series_prev)
+
+
+def sample_series(row_cond, db_series, total_series, cond_state: Optional[AlarmCondState]):
+    """
+    Intervals where a sample type alarm condition holds, within the total series of the conditions before.
+    If cond_state is given, db_series starts with its last row and the aggregation continues from its window.
+    The window is not advanced over the last row, the one before the closing row, it is the last row of the
+    returned state.
+    """
+    if cond_state is not None and cond_state.aggregator is not None:
+        aggregator = cond_state.aggregator
+    else:
+        aggregator = SampleAggregator(row_cond, cond_state.agg_values if cond_state is not None else None,
+                                      cond_state.agg_pos if cond_state is not None else 0)
+    in_total = total_series.timestamps_in(r["timestamp"] for r in db_series)
+    if cond_state is not None:
+        in_total[0] = cond_state.in_total
+    current_series = series_intersect.Series()
+    pairs = list(prev_iterator(db_series, include_first=False))
+    for r_idx, (r_series_prev, r_series) in enumerate(pairs):
+        if not in_total[r_idx]:
+            continue
+        aggregated_value = aggregator.evaluate(r_series_prev, r_series)
+        if r_idx + 1 < len(pairs):
+            aggregator.advance(r_series_prev, r_series)
+
+        debug_print(aggregated_value)
+        if check_rel(row_cond["rel"], aggregated_value, row_cond["value_num"]):
+            t = series_intersect.TimePeriod(r_series_prev["timestamp"], r_series["timestamp"],
+                                            f'{row_cond["device"]} {row_cond["data_id"]} '
+                                            f'{aggregated_value}       ({row_cond["rel"]} {row_cond["value_num"]})')
+            current_series.add(t)
+    if not pairs:
+        return current_series, None
+    return current_series, AlarmCondState(db_series[-2], in_total[-2], aggregator.agg_values, aggregator,
+                                          aggregator.first_pos, cond_state.agg_saved if cond_state is not None else None)
+
+
+def fresh_cond_states(row_alarm, cond_states):
+    """
+    The condition states worth continuing from. A state with its last row before the window of the alarm is
+    dropped, typically one of a condition not reached for a while, the check loads that condition from
+    last_check instead of going back to the old row.
+    """
+    if row_alarm["window"] is None:
+        return cond_states
+    limit = row_alarm["last_check"] - timedelta(seconds=row_alarm["window"])
+    return {cond: s for cond, s in cond_states.items() if s.last_row["timestamp"] >= limit}
+
+
+async def check_alarm(conn, row_alarm, row_alarm_recno, db_conds, loader: SeriesCheckLoader, param_now, *,
+                      override_last_check=None, incremental=False):
+    """
+    Checks one alarm on conn, in the transaction of the caller. Creates the event and the recipients if the
+    alarm is in alarm state, and updates last_check. Returns the check result or None, and the condition states
+    to keep after the transaction is committed, in incremental mode. The series of the conditions are taken
+    from the loader if it has them.
+    """
+    res = None
+    last_check = row_alarm["last_check"] if override_last_check is None else override_last_check
+
+    state = None
+    new_state = None
+    if incremental and override_last_check is None:
+        state = await alarm_states.take(conn, row_alarm["id"], row_alarm["last_check"])
+        if state is not None:
+            state.conds = fresh_cond_states(row_alarm, state.conds)
+        # conditions not reached this time continue from where they were
+        new_state = AlarmState(None, dict(state.conds) if state is not None else {})
+
+    total_series = None
+    # intersected in one pass, when a sample condition needs the total so far, or at the end
+    pending_series = []
+    if row_alarm["window"] is not None:
+        window_series = series_intersect.Series()
+        window_series.add(series_intersect.TimePeriod(last_check - timedelta(seconds=row_alarm["window"]), None))
+        pending_series.append(window_series)
+    # todo 5: maybe use "timestamp" AND "sequence" for intervals instead of "timestamp" only
+    for row_cond_recno, row_cond in enumerate(db_conds, start=1):
+        if row_cond["log_row_category"] == AlarmCondLogRowCategory.sample and pending_series:
+            total_series = series_intersect.Series.intersect_all(pending_series)
+            pending_series = [total_series]
+            debug_print(f"total_series ({row_cond_recno - 1}):")
+            debug_print(total_series)
+            if len(total_series) == 0:
+                break
+        cond_state = state.conds.get(row_cond["id"]) if state is not None else None
+        if cond_state is not None:
+            last_row = cond_state.last_row
+            db_series = loader.get_after(row_cond["device"], row_cond["data_id"], last_row["timestamp"], last_row["sequence"])
+            if db_series is None:
+                write_debug_sql(f"alarm_check_load_series_{row_alarm_recno}_{row_cond_recno}.sql",
+                                series_check_load_after_sql, row_cond["device"], row_cond["data_id"],
+                                last_row["timestamp"], last_row["sequence"], param_now)
+                db_series = await conn.fetch(series_check_load_after_sql, row_cond["device"], row_cond["data_id"],
+                                             last_row["timestamp"], last_row["sequence"], param_now)
+            db_series = [last_row] + db_series
+        else:
+            last_check_mod = last_check
+            if total_series is not None and row_cond["log_row_category"] == AlarmCondLogRowCategory.sample:
+                last_check_mod = min((i for i in (last_check_mod, total_series[0].start) if i is not None), default=None)
+            db_series = loader.get(row_cond["device"], row_cond["data_id"], last_check_mod)
+            if db_series is None:
+                write_debug_sql(f"alarm_check_load_series_{row_alarm_recno}_{row_cond_recno}.sql",
+                                series_check_load_sql, row_cond["device"], row_cond["data_id"], last_check_mod, param_now)
+                db_series = await conn.fetch(series_check_load_sql, row_cond["device"], row_cond["data_id"], last_check_mod, param_now)
+
+        if row_cond["log_row_category"] == AlarmCondLogRowCategory.sample:
+            current_series, cond_state = sample_series(row_cond, db_series, total_series, cond_state)
+        else:
+            current_series = condition_series(row_cond, db_series)
+            cond_state = AlarmCondState(db_series[-2]) if len(db_series) > 1 else None
+        if new_state is not None and cond_state is not None:
+            new_state.conds[row_cond["id"]] = cond_state
+
+        debug_print(f"current_series ({row_cond_recno}):")
+        debug_print(current_series)
+        pending_series.append(current_series)
+        if len(current_series) == 0:
+            break
+
+    if pending_series:
+        total_series = series_intersect.Series.intersect_all(pending_series)
+        debug_print("total_series:")
+        debug_print(total_series)
+
+    sql_update_alarm = "update alarm set last_check = $2"
+
+    if total_series is not None and len(total_series) > 0:
+        res = AlarmEventCheckResult(alarm=row_alarm["name"], alarmevent_count=len(total_series))
+        sql_insert = dedent("""\
+            insert into alarm_event (alarm, created, summary, description)
+            values ($1, now(), $2, $3)
+            returning id
+            """)
+        summary = f'{row_alarm["name"]}   {total_series[0].start} - {total_series[-1].end}'
+        description = "\n\n".join(f'{s.start} - {s.end}\n{textwrap.indent(s.extra, " - ") if s is not None else ""}' for s in total_series)
+        alarm_event_id = (await conn.fetchrow(sql_insert, row_alarm["id"], summary, description))[0]
+
+        subs = await conn.fetch("select distinct \"user\", method, address, address_name "
+                                "from alarm_sub where groups @> ARRAY[$1]::varchar[200][] "
+                                "and \"status\" = 'active'", row_alarm["subsgroup"])
+        for sub in subs:
+            sql_r = dedent("""\
+                       insert into alarm_recipient (event, "user", method, address, address_name, "status")
+                       values ($1, $2, $3, $4, $5, $6)""")
+            await conn.execute(sql_r, alarm_event_id, sub["user"], sub["method"],
+                               sub["address"], sub["address_name"], AlarmRecipientStatus.outbox)
+        sql_update_alarm += ", last_report = $2"
+    sql_update_alarm += " where id = $1 returning last_check"
+    new_last_check = (await conn.fetchrow(sql_update_alarm, row_alarm["id"], param_now))[0]
+    if new_state is not None:
+        new_state.last_check = new_last_check
+        await alarm_states.save(conn, new_state)
+    return res, new_state
+
+
+async def check_alarmevent(credentials, alarm: str, max_count, *, override_last_check=None, override_now=None,
+                           incremental=False, parallel=False, wait=None):
+    """
+    Checks the active alarms, creates events and recipients for the ones in alarm state.
+
+    In incremental mode the condition states of the previous check are kept, see AlarmStateStore, and only
+    the log rows after them are loaded. Sample conditions keep their aggregation window between checks. A full
+    check starts the window empty at the first row it loads, so for the first rows of a check, until the window
+    fills up, the aggregates of the two modes differ, and so can the events.
+
+    By default all alarms are checked one after the other in one transaction. In parallel mode at most
+    `alarm_check_concurrency` alarms are checked at the same time, each on its own connection and in its own
+    transaction, so an alarm's event is committed as soon as it is checked. An alarm being checked by another
+    check at the same time is skipped.
+
+    The conditions of all alarms to check are read up front, and the log rows they need are loaded once per
+    signal, see SeriesCheckLoader.
+
+    If wait is given, the check is driven by the log writes, see AlarmTrigger: it waits for them at most wait
+    seconds, and checks only the alarms with a condition on a written signal. All alarms are checked if
+    nothing was written, and at least every wait seconds.
+    """
+    keys = await alarm_trigger.wait(wait) if wait is not None else None
     res = []
     param_now = datetime.now() if override_now is None else override_now
+    checked_states = {}
+    sql_alarm_where = dedent(f"""\
+        where
+          status = '{CommonStatusEnum.active}' 
+          and ( max_freq is null 
+                or last_report is null 
+                or ($1 > last_report + max_freq * interval '1 second'))""")
+    sql_alarm = "select * from alarm\n" + sql_alarm_where + "\n"
+    params = [param_now]
+    if alarm is not None:
+        params.append(alarm)
+        sql_alarm += f"and \"name\" = ${len(params)}\n"
+    if keys is not None:
+        params.append([device for device, _ in keys])
+        params.append([data_id for _, data_id in keys])
+        sql_alarm += dedent(f"""\
+            and exists (select 1
+                        from alarm_cond c
+                        join unnest(${len(params) - 1}::varchar(200)[], ${len(params)}::varchar(200)[]) k(device, data_id)
+                          on k.device = c.device and k.data_id = c.data_id
+                        where c.alarm = alarm.id)
+            """)
+    if max_count is not None:
+        params.append(override_last_check)
+        sql_alarm += f"order by ($1 - coalesce(${len(params)}, last_check)) / nullif(max_freq,0) desc, last_check asc\n"
+
+    if parallel:
+        async with DatabaseConnection() as conn:
+            write_debug_sql("alarm.sql", sql_alarm, *params)
+            db_alarm = await conn.fetch(sql_alarm, *params)
+            if max_count is not None:
+                db_alarm = db_alarm[:max_count]
+            db_conds, loader = await prepare_alarm_check(conn, db_alarm, param_now,
+                                                         override_last_check=override_last_check,
+                                                         incremental=incremental)
+        return await check_alarms_parallel(db_alarm, db_conds, loader, sql_alarm_where, param_now,
+                                           override_last_check=override_last_check, incremental=incremental)
+
     async with DatabaseConnection() as conn:
         async with conn.transaction(isolation='repeatable_read'):
-            sql_alarm = dedent(f"""\
-                select * from alarm
-                where
-                  status = '{CommonStatusEnum.active}' 
-                  and ( max_freq is null 
-                        or last_report is null 
-                        or ($1 > last_report + max_freq * interval '1 second'))""")
-            params = [param_now]
-            if alarm is not None:
-                params.append(alarm)
-                sql_alarm += f"and \"name\" = ${len(params)}\n"
-            if max_count is not None:
-                params.append(override_last_check)
-                sql_alarm += f"order by ($1 - coalesce(${len(params)}, last_check)) / nullif(max_freq,0) desc, last_check asc\n"
             write_debug_sql("alarm.sql", sql_alarm, *params)
             db_alarm = await conn.fetch(sql_alarm, *params)
+            if max_count is not None:
+                db_alarm = db_alarm[:max_count]
+            db_conds, loader = await prepare_alarm_check(conn, db_alarm, param_now,
+                                                         override_last_check=override_last_check,
+                                                         incremental=incremental)
             for row_alarm_recno, row_alarm in enumerate(db_alarm, start=1):
-                if max_count is not None and row_alarm_recno > max_count:
-                    break
+                alarm_res, new_state = await check_alarm(conn, row_alarm, row_alarm_recno, db_conds[row_alarm["id"]],
+                                                         loader, param_now,
+                                                         override_last_check=override_last_check,
+                                                         incremental=incremental)
+                if alarm_res is not None:
+                    res.append(alarm_res)
+                if new_state is not None:
+                    checked_states[row_alarm["id"]] = new_state
+
+    for alarm_id, state in checked_states.items():
+        alarm_states.put(alarm_id, state)
+    return res
 
-                last_check = row_alarm["last_check"] if override_last_check is None else override_last_check
-
-                sql_cond = "select * from alarm_cond where alarm = $1 order by log_row_category" # cond/ev/sample order
-                db_conds = await conn.fetch(sql_cond, row_alarm["id"])
-                total_series = None
-                if row_alarm["window"] is not None:
-                    total_series = series_intersect.Series()
-                    total_series.add(series_intersect.TimePeriod(last_check - timedelta(seconds=row_alarm["window"]), None))
-                # todo 5: maybe use "timestamp" AND "sequence" for intervals instead of "timestamp" only
-                for row_cond_recno, row_cond in enumerate(db_conds, start=1):
-                    last_check_mod = last_check
-                    if total_series is not None and row_cond["log_row_category"] == AlarmCondLogRowCategory.sample:
-                        last_check_mod = min((i for i in (last_check_mod, total_series[0].start) if i is not None), default=None)
-                    write_debug_sql(f"alarm_check_load_series_{row_alarm_recno}_{row_cond_recno}.sql",
-                                    series_check_load_sql, row_cond["device"], row_cond["data_id"], last_check_mod, param_now)
-                    db_series = await conn.fetch(series_check_load_sql, row_cond["device"], row_cond["data_id"], last_check_mod, param_now)
-                    current_series = series_intersect.Series()
-                    agg_values = []
-                    for r_series_prev, r_series in prev_iterator(db_series, include_first=False):
-                        if row_cond["log_row_category"] == AlarmCondLogRowCategory.condition:
-                            if ( row_cond["value_text"] == r_series_prev["value_text"]
-                               or (row_cond["value_text"] == AlarmCondConditionValue.abnormal
-                                   and r_series_prev["value_text"] in (AlarmCondConditionValue.warning, AlarmCondConditionValue.fault)
-                                   )
-                                 ):
-                                age_min = timedelta(seconds=row_cond["age_min"] if row_cond["age_min"] else 0)
-                                if r_series_prev["timestamp"] + age_min < r_series["timestamp"]:
-                                    t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min, r_series["timestamp"],
-                                                                    f'{row_cond["device"]} {row_cond["data_id"]} {row_cond["value_text"]}'
-                                                                    )
-                                    current_series.add(t)
-                        elif row_cond["log_row_category"] == AlarmCondLogRowCategory.event:
-                            if check_rel(row_cond["rel"], row_cond["value_text"], r_series_prev["value_text"]):
-                                age_min = timedelta(seconds=row_cond["age_min"] if row_cond["age_min"] and row_cond["age_min"] > 0 else 0)
-                                age_max = timedelta(seconds=row_cond["age_max"]) if row_cond["age_max"] else None
-                                if r_series_prev["timestamp"] + age_min < r_series["timestamp"]:
-                                    if age_max is None or r_series["timestamp"] + age_max > r_series["timestamp"]:
-                                        t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min,
-                                                                        r_series["timestamp"],
-                                                                        f'{row_cond["device"]} {row_cond["data_id"]} '
-                                                                        f'{r_series_prev["value_text"]}       ({row_cond["rel"]} {row_cond["value_text"]})')
-                                    else:
-                                        t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min,
-                                                                        r_series_prev["timestamp"] + age_max,
-                                                                        f'{row_cond["device"]} {row_cond["data_id"]} '
-                                                                        f'{r_series_prev["value_text"]}       ({row_cond["rel"]} {row_cond["value_text"]})')
-                                    current_series.add(t)
-                        elif row_cond["log_row_category"] == AlarmCondLogRowCategory.sample:
-                            if not total_series.is_timestamp_in(r_series_prev["timestamp"]):
-                                continue
-                            aggregated_value = None
-                            if row_cond["aggregate_period"]:
-                                agg_time_len = (r_series["timestamp"] - agg_values[0]["timestamp"]).total_seconds() if len(agg_values) > 0 else 0
-                                if agg_time_len >= row_cond["aggregate_period"]:
-                                    aggregated_value = calc_aggregate(row_cond["aggregate_method"], agg_values, AlarmCondSampleAggSlopeKind.time)
-                                agg_values.append(r_series_prev)
-                                while len(agg_values) > 0 \
-                                        and (r_series["timestamp"] - agg_values[0]["timestamp"]).total_seconds() > row_cond["aggregate_period"]:
-                                    del agg_values[0]
-                            if row_cond["aggregate_count"]:
-                                if len(agg_values) == row_cond["aggregate_count"]:
-                                    aggregated_value = calc_aggregate(row_cond["aggregate_method"], agg_values, AlarmCondSampleAggSlopeKind.position)
-                                    del agg_values[0]
-                                agg_values.append(r_series_prev)
-
-                            debug_print(aggregated_value)
-                            if check_rel(row_cond["rel"], aggregated_value, row_cond["value_num"]):
-                                t = series_intersect.TimePeriod(r_series_prev["timestamp"], r_series["timestamp"],
-                                                                f'{row_cond["device"]} {row_cond["data_id"]} '
-                                                                f'{aggregated_value}       ({row_cond["rel"]} {row_cond["value_num"]})')
-                                current_series.add(t)
-
-                    debug_print(f"current_series ({row_cond_recno}):")
-                    debug_print(current_series)
-                    if total_series is None:
-                        total_series = current_series
-                    else:
-                        total_series = series_intersect.Series.intersect(total_series, current_series)
-                    if len(total_series) == 0:
-                        break
-                    debug_print(f"total_series ({row_cond_recno}):")
-                    debug_print(total_series)
-
-                sql_update_alarm = "update alarm set last_check = $2"
-
-                if total_series is not None and len(total_series) > 0:
-                    res.append(AlarmEventCheckResult(alarm=row_alarm["name"], alarmevent_count=len(total_series)))
-                    sql_insert = dedent("""\
-                        insert into alarm_event (alarm, created, summary, description)
-                        values ($1, now(), $2, $3)
-                        returning id
-                        """)
-                    summary = f'{row_alarm["name"]}   {total_series[0].start} - {total_series[-1].end}'
-                    description = "\n\n".join(f'{s.start} - {s.end}\n{textwrap.indent(s.extra, " - ") if s is not None else ""}' for s in total_series)
-                    alarm_event_id = (await conn.fetchrow(sql_insert, row_alarm["id"], summary, description))[0]
-
-                    subs = await conn.fetch("select distinct \"user\", method, address, address_name "
-                                            "from alarm_sub where groups @> ARRAY[$1]::varchar[200][] "
-                                            "and \"status\" = 'active'", row_alarm["subsgroup"])
-                    for sub in subs:
-                        sql_r = dedent("""\
-                                   insert into alarm_recipient (event, "user", method, address, address_name, "status")
-                                   values ($1, $2, $3, $4, $5, $6)""")
-                        await conn.execute(sql_r, alarm_event_id, sub["user"], sub["method"],
-                                           sub["address"], sub["address_name"], AlarmRecipientStatus.outbox)
-                    sql_update_alarm += ", last_report = $2"
-                sql_update_alarm += "where id = $1"
-                await conn.execute(sql_update_alarm, row_alarm["id"], param_now)
 
-    return res
+async def prepare_alarm_check(conn, db_alarm, param_now, *, override_last_check=None, incremental=False):
+    """
+    Reads the conditions of the alarms, by alarm id, and prefetches the series they need into a shared loader.
+    Incremental conditions need their series from the last row of their state, if it is at hand in memory.
+    """
+    sql_cond = "select * from alarm_cond where alarm = any($1::integer[]) order by alarm, log_row_category" # cond/ev/sample order
+    db_conds = {row_alarm["id"]: [] for row_alarm in db_alarm}
+    for row_cond in await conn.fetch(sql_cond, list(db_conds)):
+        db_conds[row_cond["alarm"]].append(row_cond)
+
+    loader = SeriesCheckLoader(param_now)
+    for row_alarm in db_alarm:
+        last_check = row_alarm["last_check"] if override_last_check is None else override_last_check
+        state = None
+        if incremental and override_last_check is None:
+            state = alarm_states.peek(row_alarm["id"], row_alarm["last_check"])
+        cond_states = fresh_cond_states(row_alarm, state.conds) if state is not None else {}
+        for row_cond in db_conds[row_alarm["id"]]:
+            cond_state = cond_states.get(row_cond["id"])
+            if cond_state is not None:
+                loader.require(row_cond["device"], row_cond["data_id"], cond_state.last_row["timestamp"])
+            else:
+                loader.require(row_cond["device"], row_cond["data_id"], last_check)
+    await loader.prefetch(conn)
+    return db_conds, loader
+
+
+async def check_alarms_parallel(db_alarm, db_conds, loader: SeriesCheckLoader, sql_alarm_where, param_now, *,
+                                override_last_check=None, incremental=False):
+    """
+    Parallel mode of check_alarmevent. The alarm row is locked and read again in the alarm's own transaction,
+    the ones locked by another check, or not due any more, are skipped. An error does not stop the other alarms,
+    the first one is raised after all of them are done.
+    """
+    semaphore = asyncio.Semaphore(alarm_check_concurrency)
+    sql_lock = "select * from alarm\n" + sql_alarm_where + "\nand id = $2\nfor update skip locked"
+
+    async def check_one(row_alarm_recno, alarm_id):
+        async with semaphore:
+            async with DatabaseConnection() as conn:
+                async with conn.transaction(isolation='repeatable_read'):
+                    row_alarm = await conn.fetchrow(sql_lock, param_now, alarm_id)
+                    if row_alarm is None:
+                        return None
+                    alarm_res, new_state = await check_alarm(conn, row_alarm, row_alarm_recno, db_conds[alarm_id],
+                                                             loader, param_now,
+                                                             override_last_check=override_last_check,
+                                                             incremental=incremental)
+            if new_state is not None:
+                alarm_states.put(alarm_id, new_state)
+            return alarm_res
+
+    results = await asyncio.gather(*(check_one(row_alarm_recno, row_alarm["id"])
+                                     for row_alarm_recno, row_alarm in enumerate(db_alarm, start=1)),
+                                   return_exceptions=True)
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+    return [r for r in results if r is not None]
 
 
 async def alarmevent_list(credentials, id=None, alarm=None, alarm_mask=None,
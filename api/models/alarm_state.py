@@ -0,0 +1,150 @@
+from datetime import datetime
+from textwrap import dedent
+from typing import Dict, Iterable, Optional
+
+
+class AlarmCondState:
+    """
+    Where the incremental check of a condition stopped: the last log row processed, whether it was in the
+    total series of the conditions before, and the rolling aggregation window of a sample condition. The
+    aggregator with its running statistics is only kept in memory, the window rows are saved.
+
+    The window rows are numbered in the order they entered the window, agg_pos is the number of the first one.
+    agg_saved is the number after the last row saved, None if the saved rows are not the ones of this window.
+    """
+    __slots__ = ['last_row', 'in_total', 'agg_values', 'aggregator', 'agg_pos', 'agg_saved']
+
+    def __init__(self, last_row, in_total: bool = True, agg_values: Optional[Iterable] = None, aggregator=None,
+                 agg_pos: int = 0, agg_saved: Optional[int] = None):
+        self.last_row = last_row
+        self.in_total = in_total
+        self.agg_values = agg_values
+        self.aggregator = aggregator
+        self.agg_pos = agg_pos
+        self.agg_saved = agg_saved
+
+
+class AlarmState:
+    """ Condition states of an alarm, valid while the last_check of the alarm equals the one saved with it. """
+    __slots__ = ['last_check', 'conds']
+
+    def __init__(self, last_check: Optional[datetime], conds: Dict[int, AlarmCondState]):
+        self.last_check = last_check
+        self.conds = conds
+
+
+class AlarmStateStore:
+    """
+    Keeps the alarm states in memory, and the checkpoints in the alarm_cond_state table. A state is taken out
+    for a check, and put back after the check committed, so a failed check continues from the checkpoint.
+
+    The aggregation windows are saved in alarm_cond_state_agg, one row per window row. A check only inserts the
+    rows that entered the window and deletes the ones that left it, so a long window costs nothing per check
+    when few rows move.
+    """
+    def __init__(self):
+        self.alarms: Dict[int, AlarmState] = {}
+
+    async def take(self, conn, alarm_id: int, last_check: datetime) -> Optional[AlarmState]:
+        state = self.alarms.pop(alarm_id, None)
+        if state is not None and state.last_check == last_check:
+            return state
+        sql = dedent("""\
+            select s.*
+            from alarm_cond_state s
+            join alarm_cond c on c.id = s.cond
+            where
+              c.alarm = $1
+              and s.last_check = $2""")
+        rs = await conn.fetch(sql, alarm_id, last_check)
+        if not rs:
+            return None
+        sql_agg = dedent("""\
+            select cond, pos, "timestamp", value_num
+            from alarm_cond_state_agg
+            where cond = any($1::integer[])
+            order by cond, pos""")
+        agg = {r["cond"]: [] for r in rs if r["agg_pos"] is not None}
+        if agg:
+            for a in await conn.fetch(sql_agg, list(agg)):
+                agg[a["cond"]].append(a)
+        conds = {}
+        for r in rs:
+            last_row = dict(timestamp=r["timestamp"], sequence=r["sequence"],
+                            value_num=r["value_num"], value_text=r["value_text"])
+            if r["agg_pos"] is None:
+                conds[r["cond"]] = AlarmCondState(last_row, r["in_total"])
+                continue
+            # rows left from an earlier, abandoned window have lower numbers
+            agg_values = [dict(timestamp=a["timestamp"], value_num=a["value_num"])
+                          for a in agg[r["cond"]] if a["pos"] >= r["agg_pos"]]
+            conds[r["cond"]] = AlarmCondState(last_row, r["in_total"], agg_values, agg_pos=r["agg_pos"],
+                                              agg_saved=r["agg_pos"] + len(agg_values))
+        return AlarmState(last_check, conds)
+
+    async def save(self, conn, state: AlarmState):
+        """ Writes the checkpoint, call it in the transaction that updates last_check of the alarm. """
+        if not state.conds:
+            return
+        sql = dedent("""\
+            insert into alarm_cond_state (cond, last_check, "timestamp", sequence, value_num, value_text, in_total, agg_pos)
+            select s.cond, $2, s."timestamp", s.sequence, s.value_num, s.value_text, s.in_total, s.agg_pos
+            from unnest($1::integer[], $3::timestamptz[], $4::integer[], $5::double precision[], $6::varchar[],
+                        $7::boolean[], $8::bigint[])
+                 s(cond, "timestamp", sequence, value_num, value_text, in_total, agg_pos)
+            on conflict (cond) do update set
+              last_check = excluded.last_check,
+              "timestamp" = excluded."timestamp",
+              sequence = excluded.sequence,
+              value_num = excluded.value_num,
+              value_text = excluded.value_text,
+              in_total = excluded.in_total,
+              agg_pos = excluded.agg_pos""")
+        sql_agg_delete = dedent("""\
+            delete from alarm_cond_state_agg a
+            using unnest($1::integer[], $2::bigint[], $3::boolean[]) d(cond, pos, whole)
+            where
+              a.cond = d.cond
+              and (d.whole or a.pos < d.pos)""")
+        sql_agg_insert = dedent("""\
+            insert into alarm_cond_state_agg (cond, pos, "timestamp", value_num)
+            select *
+            from unnest($1::integer[], $2::bigint[], $3::timestamptz[], $4::double precision[])""")
+        items = sorted(state.conds.items())
+        await conn.execute(sql, [c for c, _ in items], state.last_check,
+                           [s.last_row["timestamp"] for _, s in items],
+                           [s.last_row["sequence"] for _, s in items],
+                           [s.last_row["value_num"] for _, s in items],
+                           [s.last_row["value_text"] for _, s in items],
+                           [s.in_total for _, s in items],
+                           [s.agg_pos if s.agg_values is not None else None for _, s in items])
+
+        # the window rows that left are deleted, the ones that entered are inserted, all of them if the saved
+        # rows are not of this window
+        deleted = [(c, s.agg_pos, s.agg_saved is None) for c, s in items if s.agg_values is not None]
+        inserted = []
+        for c, s in items:
+            if s.agg_values is None:
+                continue
+            start = s.agg_pos if s.agg_saved is None else max(s.agg_saved, s.agg_pos)
+            for i in range(start - s.agg_pos, len(s.agg_values)):
+                v = s.agg_values[i]
+                inserted.append((c, s.agg_pos + i, v["timestamp"], v["value_num"]))
+            s.agg_saved = s.agg_pos + len(s.agg_values)
+        if deleted:
+            await conn.execute(sql_agg_delete, *(list(col) for col in zip(*deleted)))
+        if inserted:
+            await conn.execute(sql_agg_insert, *(list(col) for col in zip(*inserted)))
+
+    def peek(self, alarm_id: int, last_check: datetime) -> Optional[AlarmState]:
+        """ The state in memory, if it is valid for last_check. Does not take it out or load the checkpoint. """
+        state = self.alarms.get(alarm_id)
+        if state is not None and state.last_check == last_check:
+            return state
+        return None
+
+    def put(self, alarm_id: int, state: AlarmState):
+        self.alarms[alarm_id] = state
+
+
+alarm_states = AlarmStateStore()
@@ -0,0 +1,56 @@
+import time
+import asyncio
+from typing import Optional, Set, Tuple
+from models.log.notify import LogChange, log_changes
+
+
+class AlarmTrigger:
+    """
+    Collects the (device, data_id) keys written to the log since the previous event driven alarm check. Only
+    the alarms with a condition on these need to be checked again. Conditions that change with the passing of
+    time, like age_min, are left to a full check that is done at least every sweep interval.
+
+    Fed by the log change notifications, so it sees the committed writes of all the api processes. Deletes, and
+    changes that may have been missed while the listen connection was down, make the next check a full one.
+    """
+    def __init__(self):
+        self.touched: Set[Tuple[str, str]] = set()
+        self.sweep_due = False
+        self.changed: Optional[asyncio.Event] = None  # created in the event loop, by the first wait
+        self.last_sweep: Optional[float] = None
+        log_changes.subscribe(self.log_changed)
+
+    def log_changed(self, change: LogChange):
+        if change.keys is None or change.devices - {device for device, _ in change.keys}:
+            self.sweep_due = True
+        else:
+            self.touched |= change.keys
+        if self.changed is not None:
+            self.changed.set()
+
+    async def wait(self, sweep_interval: float) -> Optional[Set[Tuple[str, str]]]:
+        """
+        Waits until something is written to the log, and returns the keys written since the previous call.
+        Returns None if a full check is due, the first time or sweep_interval seconds after the previous one.
+        """
+        if self.changed is None:
+            self.changed = asyncio.Event()
+        if self.last_sweep is not None:
+            deadline = self.last_sweep + sweep_interval
+            while not self.touched and not self.sweep_due and time.monotonic() < deadline:
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+            if not self.sweep_due and time.monotonic() < deadline:
+                keys, self.touched = self.touched, set()
+                return keys
+        # the full check covers everything written so far
+        self.last_sweep = time.monotonic()
+        self.touched = set()
+        self.sweep_due = False
+        return None
+
+
+alarm_trigger = AlarmTrigger()
@@ -1,5 +1,6 @@
+from bisect import bisect_right
 from pydantic import Field
-from common import I4cBaseModel
+from common import I4cBaseModel, write_debug_sql
 
 
 class PatchResponse(I4cBaseModel):
@@ -19,6 +20,8 @@ def prev_iterator(iterable, *, include_first=True):
 
 series_check_load_sql = open("models/series_check_load.sql").read()
 series_check_load_extra_sql = open("models/series_check_load_extra.sql").read()
+series_check_load_after_sql = open("models/series_check_load_after.sql").read()
+series_check_load_batch_sql = open("models/series_check_load_batch.sql").read()
 
 
 def check_rel(rel, left, right):
@@ -43,3 +46,63 @@ def check_rel(rel, left, right):
     if rel in (">=", "gte"):
         return left >= right
     return False
+
+
+class SeriesCheckLoader:
+    """
+    Shares the log rows between the alarm conditions of a check that watch the same signal. The requirements of
+    the conditions are collected first, then prefetch loads every (device, data_id) once, from the earliest
+    last_check required, in one query. The loaded rows of a signal are a contiguous run of its log up to now, a
+    condition gets its part of it with get or get_after. These return None if the part is not covered, the
+    condition loads it on its own then.
+    """
+    def __init__(self, now):
+        self.now = now
+        self.required = {}
+        self.series = {}
+        self.timestamps = {}
+        self.keys = {}
+        self.closing = None
+
+    def require(self, device, data_id, last_check):
+        if last_check is None:
+            return
+        key = (device, data_id)
+        if key not in self.required or last_check < self.required[key]:
+            self.required[key] = last_check
+
+    async def prefetch(self, conn):
+        if not self.required:
+            return
+        items = sorted(self.required.items())
+        params = ([device for (device, _), _ in items], [data_id for (_, data_id), _ in items],
+                  [last_check for _, last_check in items], min(last_check for _, last_check in items), self.now)
+        write_debug_sql("alarm_check_load_series_batch.sql", series_check_load_batch_sql, *params)
+        rs = await conn.fetch(series_check_load_batch_sql, *params)
+        self.series = {key: [] for key in self.required}
+        for r in rs:
+            if r["device"] is None:
+                self.closing = r
+            else:
+                self.series[(r["device"], r["data_id"])].append(r)
+        for key, rows in self.series.items():
+            self.timestamps[key] = [r["timestamp"] for r in rows]
+            self.keys[key] = [(r["timestamp"], r["sequence"]) for r in rows]
+
+    def get(self, device, data_id, last_check):
+        """ The rows of series_check_load_sql: the last one at last_check, the ones after it, and the closing row. """
+        key = (device, data_id)
+        rows = self.series.get(key)
+        if rows is None or last_check is None or (rows and rows[0]["timestamp"] > last_check):
+            return None
+        i = bisect_right(self.timestamps[key], last_check)
+        return rows[max(i - 1, 0):] + [self.closing]
+
+    def get_after(self, device, data_id, timestamp, sequence):
+        """ The rows of series_check_load_after_sql: the ones after the given one, and the closing row. """
+        key = (device, data_id)
+        rows = self.series.get(key)
+        if rows is None or (rows and self.keys[key][0] > (timestamp, sequence)):
+            return None
+        i = bisect_right(self.keys[key], (timestamp, sequence))
+        return rows[i:] + [self.closing]
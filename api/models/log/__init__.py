@@ -1,7 +1,11 @@
 from .snapshot import Snapshot, get_snapshot
-from .find import DataPointDevice, DataPointLog, DataPointKey, get_find
+from .find import DataPointDevice, DataPointLog, DataPointKey, LogFindStream, LogFindStats, get_find, get_find_stream, get_find_stats
+from .browse import LogPage, LogBrowseDirection, get_browse
 from .meta import Meta, get_meta
-from .log_write import put_log_write
-from .delete_log import delete_log
-from .last_instance import LastInstance, get_last_instance
+from .log_write import put_log_write, put_log_write_bulk, put_log_write_stream, LogWriteStreamResult
+from .latest import latest_values
+from .notify import LogChange, log_changes, notify_log_change
+from .live import snapshot_hub
+from .delete_log import LogDelete, LogDeleteResult, delete_log, delete_log_bulk
+from .last_instance import LastInstance, LastInstanceDevice, get_last_instance, get_last_instances
 from .enums import *
@@ -0,0 +1,111 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+from enum import Enum
+from typing import Optional, List
+from textwrap import dedent
+from pydantic import Field
+from common import I4cBaseModel, DatabaseConnection, write_debug_sql
+from common.db_tools import asyncpg_rows_process_json
+from common.exceptions import I4cClientError
+from .find import DataPointDevice
+
+log_browse_max_page_size = 10000
+
+
+class LogBrowseDirection(str, Enum):
+    """Direction of log browsing."""
+    backward = "backward"
+    forward = "forward"
+
+
+class LogPage(I4cBaseModel):
+    """One page of log entries."""
+    items: List[DataPointDevice] = Field(..., title="Log entries.")
+    next: Optional[str] = Field(None, title="Continuation token of the next page. Missing on the last page.")
+
+
+def encode_token(device, data_id, direction: LogBrowseDirection, timestamp: datetime, sequence: int):
+    key = [device, data_id, direction.value, timestamp.isoformat(), sequence]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode("ascii").rstrip("=")
+
+
+def decode_token(token):
+    try:
+        (device, data_id, direction, timestamp, sequence) = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return device, data_id, LogBrowseDirection(direction), datetime.fromisoformat(timestamp), int(sequence)
+    except (ValueError, TypeError, binascii.Error):
+        raise I4cClientError("Invalid continuation token.")
+
+
+def get_browse_sql(params, device, data_id, direction: LogBrowseDirection, timestamp, sequence, page_size):
+    """
+    The sql for one page. It is a single range scan of idx_ts, or idx_dts if data_id is given, starting from
+    the key, so the cost of a page does not depend on how far the browsing went.
+    """
+    (comp, order) = ("<", "desc") if direction == LogBrowseDirection.backward else (">", "asc")
+    wheres = []
+
+    params.append(device)
+    wheres.append(f"l.device = ${len(params)}")
+    if data_id is not None:
+        params.append(data_id)
+        wheres.append(f"l.data_id = ${len(params)}")
+    if timestamp is not None:
+        params.append(timestamp)
+        # the plain timestamp condition allows partition pruning
+        wheres.append(f'l."timestamp" {comp}= ${len(params)}')
+        if sequence is not None:
+            params.append(sequence)
+            wheres.append(f'(l."timestamp", l.sequence) {comp} (${len(params) - 1}, ${len(params)})')
+    params.append(page_size + 1)
+
+    return dedent(f"""\
+        select
+          l.timestamp,
+          l.sequence,
+          m.device,
+          l.instance,
+          m.data_id,
+          case when m.category='SAMPLE' THEN l.value_num::character varying(200) else l.value_text end as "value",
+          l.value_num,
+          l.value_text,
+          l.value_extra,
+          l.value_aux as value_add
+        from log l
+        join meta m on m.device = l.device and m.data_id = l.data_id
+        where {" and ".join(wheres)}
+        order by l.device {order}, l."timestamp" {order}, l.sequence {order}
+        limit ${len(params)}""")
+
+
+async def get_browse(credentials, device, data_id=None, timestamp=None, direction=LogBrowseDirection.backward,
+                     page_size=100, token=None, *, pconn=None) -> LogPage:
+    """
+    Keyset paginated log. The first page starts at the timestamp, inclusive, or at the end of the log in the
+    given direction. The next page is requested with the token returned, it encodes the device, the data_id,
+    the direction and the key of the last entry.
+    """
+    if page_size < 1 or page_size > log_browse_max_page_size:
+        raise I4cClientError(f"page_size must be between 1 and {log_browse_max_page_size}")
+
+    sequence = None
+    if token is not None:
+        (t_device, data_id, direction, timestamp, sequence) = decode_token(token)
+        if t_device != device:
+            raise I4cClientError("The continuation token belongs to another device.")
+
+    params = []
+    sql = get_browse_sql(params, device, data_id, direction, timestamp, sequence, page_size)
+    write_debug_sql('get_browse.sql', sql, *params)
+
+    async with DatabaseConnection(pconn) as conn:
+        rs = await conn.fetch(sql, *params)
+
+    items = [DataPointDevice(**r) for r in asyncpg_rows_process_json(rs[:page_size], 'value_add')]
+    next_token = None
+    if len(rs) > page_size:
+        last = rs[page_size - 1]
+        next_token = encode_token(device, data_id, direction, last["timestamp"], last["sequence"])
+    return LogPage(items=items, next=next_token)
@@ -1,6 +1,29 @@
+from datetime import datetime
+from typing import List, Optional
 from textwrap import dedent
-from common import DatabaseConnection
+from pydantic import Field
+from common import I4cBaseModel, DatabaseConnection, apicfg
+from common.exceptions import I4cInputValidationError
 from models.log import DataPointKey
+from .latest import latest_values
+from .notify import notify_log_change
+
+log_delete_chunk = int(apicfg.get("log_delete_chunk", 5000))
+
+
+class LogDelete(I4cBaseModel):
+    """Selects log rows to delete. Either the keys, or the device and a time range."""
+    keys: Optional[List[DataPointKey]] = Field(None, title="Exact rows to delete.")
+    device: Optional[str] = Field(None, title="Device.")
+    data_id: Optional[List[str]] = Field(None, title="Data types, all if omitted.")
+    after: Optional[datetime] = Field(None, title="Range start, inclusive.")
+    before: Optional[datetime] = Field(None, title="Range end, exclusive.")
+
+
+class LogDeleteResult(I4cBaseModel):
+    """Result of a bulk log delete."""
+    chunks: List[int] = Field(..., title="Number of rows deleted, per chunk.")
+    total: int = Field(..., title="Total number of rows deleted.")
 
 
 async def delete_log(credentials, datapoint: DataPointKey, *, pconn=None):
@@ -14,6 +37,91 @@ async def delete_log(credentials, datapoint: DataPointKey, *, pconn=None):
                 """)
 
     async with DatabaseConnection(pconn) as conn:
+        local = not conn.is_in_transaction()
         await conn.execute(sql,
                            datapoint.device, datapoint.timestamp,
                            datapoint.sequence, datapoint.data_id)
+        await notify_log_change(conn, devices=[datapoint.device], local=local)
+    latest_values.invalidate(datapoint.device)
+
+
+async def delete_log_bulk(credentials, selection: LogDelete, *, chunk_size=None, pconn=None) -> LogDeleteResult:
+    """
+    Deletes the listed keys, or the rows of a device in a time range. Rows are deleted in chunks of
+    `chunk_size`, each chunk in its own statement, so the locks are held for a short time only. If it fails
+    in the middle, the chunks reported before are already deleted.
+    """
+    chunk_size = chunk_size or log_delete_chunk
+    if chunk_size < 1:
+        raise I4cInputValidationError("chunk_size must be positive")
+    has_range = selection.device is not None or selection.data_id is not None \
+        or selection.after is not None or selection.before is not None
+    if selection.keys is not None:
+        if has_range:
+            raise I4cInputValidationError("Give either keys or a device and time range, not both.")
+    elif selection.device is None or (selection.after is None and selection.before is None):
+        raise I4cInputValidationError("device and at least one of after or before are required.")
+
+    res = LogDeleteResult(chunks=[], total=0)
+
+    def add(status):
+        cnt = int(status.rpartition(" ")[2])
+        res.chunks.append(cnt)
+        res.total += cnt
+        return cnt
+
+    devices = {k.device for k in selection.keys} if selection.keys is not None else {selection.device}
+    async with DatabaseConnection(pconn) as conn:
+        local = not conn.is_in_transaction()
+        completed = False
+        try:
+            if selection.keys is not None:
+                sql = dedent("""\
+                    delete from log l
+                    using unnest($1::varchar[], $2::timestamptz[], $3::integer[], $4::varchar[])
+                          k(device, "timestamp", sequence, data_id)
+                    where
+                      l.device = k.device
+                      and l."timestamp" = k."timestamp"
+                      and l.sequence = k.sequence
+                      and l.data_id = k.data_id""")
+                for i in range(0, len(selection.keys), chunk_size):
+                    chunk = selection.keys[i:i + chunk_size]
+                    add(await conn.execute(sql,
+                                           [k.device for k in chunk], [k.timestamp for k in chunk],
+                                           [k.sequence for k in chunk], [k.data_id for k in chunk]))
+            else:
+                params = [selection.device, chunk_size]
+                cond = []
+                for (template, value) in (("data_id = any(${})", selection.data_id),
+                                          ('"timestamp" >= ${}', selection.after),
+                                          ('"timestamp" < ${}', selection.before)):
+                    if value is not None:
+                        params.append(value)
+                        cond.append("and " + template.format(len(params)))
+                cond = "\n                          ".join(cond)
+                sql = dedent(f"""\
+                    delete from log l
+                    using (
+                        select device, "timestamp", sequence
+                        from log
+                        where
+                          device = $1
+                          {cond}
+                        order by "timestamp", sequence
+                        limit $2
+                      ) k
+                    where
+                      l.device = k.device
+                      and l."timestamp" = k."timestamp"
+                      and l.sequence = k.sequence""")
+                while add(await conn.execute(sql, *params)) >= chunk_size:
+                    pass
+            completed = True
+        finally:
+            # with autocommit, the chunks deleted before a failure stay deleted
+            for device in devices:
+                latest_values.invalidate(device)
+            if completed or local:
+                await notify_log_change(conn, devices=devices, local=local)
+    return res
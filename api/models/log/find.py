@@ -1,14 +1,21 @@
+import json
 from datetime import datetime
 from enum import Enum
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
+import pytz
 from pydantic import Field
-from common import I4cBaseModel, write_debug_sql, DatabaseConnection, log
-from common.db_tools import asyncpg_rows_process_json
+from common import I4cBaseModel, write_debug_sql, DatabaseConnection, log, apicfg
+from common.db_tools import asyncpg_rows_process_json, StatementStats
 from common.exceptions import I4cClientError
 from models import Device
 
 view_find_sql = open("models/log/find.sql").read()
 
+log_find_stream_prefetch = int(apicfg.get("log_find_stream_prefetch", 1000))
+log_find_stream_buffer = 64 * 1024
+
+find_statements = StatementStats()
+
 
 class DataPointKey(I4cBaseModel):
     """Unique identifier of a data point in the log."""
@@ -39,6 +46,20 @@ class DataPointLog(DataPointBase):
     device: str = Field(..., title="Originating device.")
 
 
+class LogFindStream(str, Enum):
+    """Streamed output format of the log search."""
+    json = "json"
+    ndjson = "ndjson"
+
+
+class LogFindStats(I4cBaseModel):
+    """Statement reuse of the log search."""
+    statements: int = Field(..., title="Number of distinct statements generated.")
+    connections: int = Field(..., title="Number of open connections that prepared any.")
+    hits: int = Field(..., title="Searches run with a statement already prepared on the connection.")
+    misses: int = Field(..., title="Searches that prepared their statement.")
+
+
 class LogCondEventRel(str, Enum):
     """Relation for condition, event data type."""
     eq = "eq"
@@ -75,6 +96,10 @@ class LogCondEventRel(str, Enum):
 
 def get_find_sql(params, timestamp, sequence, before_count, after_count, categ, name, val, extra, rel, *,
                  allow_exact_ts_match: bool = True, seq_part: Optional[str] = None):
+    """
+    Builds the search sql, and appends its parameters to params. All values, including the counts and the list
+    of values, are parameters, so the sql text only depends on which filters are given, and on rel.
+    """
     wheres = []
     rank_direction = 'desc'
     count = None
@@ -83,10 +108,13 @@ def get_find_sql(params, timestamp, sequence, before_count, after_count, categ,
         rel = LogCondEventRel.eq
     if rel == LogCondEventRel.contains:
         srel = 'like \'%\'||<val>||\'%\''
+        arel = 'like any(<val>)'
     elif rel == LogCondEventRel.not_contains:
         srel = 'not like \'%\'||<val>||\'%\''
+        arel = 'not like any(<val>)'
     else:
         srel = rel.nice_value() + " <val>"
+        arel = rel.nice_value() + " any(<val>)"
 
     if before_count is None and after_count is None:
         before_count = 1
@@ -113,13 +141,14 @@ def get_find_sql(params, timestamp, sequence, before_count, after_count, categ,
     if sequence is not None and seq_part is None:
         sql_ts = get_find_sql(params, timestamp, sequence, before_count, after_count, categ, name, val, extra, rel, allow_exact_ts_match=allow_exact_ts_match, seq_part="ts")
         sql_seq = get_find_sql(params, timestamp, sequence, before_count, after_count, categ, name, val, extra, rel, allow_exact_ts_match=False, seq_part="seq")
+        params.append(count)
         return f'with ts as ({sql_ts}), '\
                f'seq as ({sql_seq}) ' \
                f'select * from ts ' \
                f'union all ' \
                f'select * from seq ' \
                f'order by timestamp {rank_direction}, "sequence" {rank_direction} ' \
-               f'limit {count}'
+               f'limit ${len(params)}::integer'
 
     if comp_rel is not None:
         if timestamp is not None and (seq_part is None or seq_part == 'ts'):
@@ -140,26 +169,34 @@ def get_find_sql(params, timestamp, sequence, before_count, after_count, categ,
         wheres.append(f'and (m.data_id = ${len(params)})')
     if val is not None:
         wheres.append('and ((0=1)')
-        for vi in val:
-            if rel not in (LogCondEventRel.contains, LogCondEventRel.not_contains):
+        if rel not in (LogCondEventRel.contains, LogCondEventRel.not_contains):
+            nums = []
+            for vi in val:
                 try:
-                    params.append(float(vi))
-                    wheres.append(f'      or ((m.category = \'SAMPLE\') and (l.value_num '
-                                  f'{srel.replace("<val>",f"${len(params)}::double precision")}))')
+                    nums.append(float(vi))
                 except ValueError:
                     pass
-            params.append(vi)
-            wheres.append(f'      or ((m.category = \'EVENT\') and (l.value_text {srel.replace("<val>",f"${len(params)}")}))')
-            params.append(vi)
-            wheres.append(f'      or ((m.category = \'CONDITION\') and (l.value_text = ${len(params)}))')
+            params.append(nums)
+            wheres.append(f'      or ((m.category = \'SAMPLE\') and (l.value_num '
+                          f'{arel.replace("<val>",f"${len(params)}::double precision[]")}))')
+            params.append(list(val))
+            idx_val = len(params)
+            wheres.append(f'      or ((m.category = \'EVENT\') and (l.value_text {arel.replace("<val>",f"${idx_val}::varchar[]")}))')
+        else:
+            params.append([f"%{vi}%" for vi in val])
+            wheres.append(f'      or ((m.category = \'EVENT\') and (l.value_text {arel.replace("<val>",f"${len(params)}::varchar[]")}))')
+            params.append(list(val))
+            idx_val = len(params)
+        wheres.append(f'      or ((m.category = \'CONDITION\') and (l.value_text = any(${idx_val}::varchar[])))')
         wheres.append('    )')
     if extra is not None:
         params.append(extra)
         wheres.append(f'and ((m.category = \'CONDITION\') and (l.value_extra {srel.replace("<val>",f"${len(params)}")}))')
 
+    params.append(count)
     sql = view_find_sql.replace("<rank_direction>", rank_direction)\
                        .replace("<wheres>", '\n'.join(wheres)) \
-                       .replace("<count>", str(count))
+                       .replace("<count>", f"${len(params)}::integer")
 
     return sql
 
@@ -176,6 +213,82 @@ async def get_find(credentials, device, timestamp=None, sequence=None, before_co
 
     async with DatabaseConnection(pconn) as conn:
         log.debug('before sql run')
+        find_statements.record(conn, sql)
         rs = await conn.fetch(sql,*params)
         log.debug('after sql run')
     return [DataPointDevice(**r) for r in asyncpg_rows_process_json(rs, 'value_add')]
+
+
+def json_timestamp(v: datetime):
+    # same format as the I4cBaseModel json encoder
+    return v.astimezone(pytz.utc).replace(tzinfo=None).isoformat(timespec='milliseconds') + 'Z'
+
+
+def find_row_json(r) -> str:
+    """
+    Serializes a row of the find query the same way as a DataPointDevice, without building the model.
+    value_add comes from the database as json text, and is copied as is, unless it is spread over lines. Those
+    are serialized again compactly, so the row stays on one line for the newline delimited format.
+    """
+    head = json.dumps({"timestamp": json_timestamp(r["timestamp"]),
+                       "sequence": r["sequence"],
+                       "instance": r["instance"],
+                       "data_id": r["data_id"],
+                       "value": r["value"],
+                       "value_num": r["value_num"],
+                       "value_text": r["value_text"],
+                       "value_extra": r["value_extra"]},
+                      ensure_ascii=False, separators=(",", ":"))
+    value_add = r["value_add"] if r["value_add"] is not None else "null"
+    if "\n" in value_add or "\r" in value_add:
+        value_add = json.dumps(json.loads(value_add), ensure_ascii=False, separators=(",", ":"))
+    return f'{head[:-1]},"value_add":{value_add},"device":{json.dumps(r["device"], ensure_ascii=False)}}}'
+
+
+def get_find_stream(credentials, device, timestamp=None, sequence=None, before_count=None, after_count=None, categ=None,
+                    data_id=None, val=None, extra=None, rel=None, *, fmt=LogFindStream.json, pconn=None) -> AsyncIterator[bytes]:
+    """
+    Streaming variant of get_find. The rows are read through a server side cursor, and the response is written
+    as it is read, either as a json array or as newline delimited json. Parameters are checked before the
+    iterator is returned, so errors are reported before the response starts.
+    """
+    if sequence is not None and timestamp is None:
+        raise I4cClientError("sequence allowed only when timestamp is not empty")
+
+    params = [device]
+    sql = get_find_sql(params, timestamp, sequence, before_count, after_count, categ, data_id, val, extra, rel)
+    write_debug_sql('get_find_stream.sql', sql, *params)
+
+    if fmt == LogFindStream.ndjson:
+        (start, sep, end) = ("", "\n", "\n")
+    else:
+        (start, sep, end) = ("[", ",", "]")
+
+    async def rows():
+        async with DatabaseConnection(pconn) as conn:
+            find_statements.record(conn, sql)
+            async with conn.transaction():
+                buf = [start]
+                size = 0
+                first = True
+                async for r in conn.cursor(sql, *params, prefetch=log_find_stream_prefetch):
+                    line = find_row_json(r)
+                    if not first:
+                        buf.append(sep)
+                    first = False
+                    buf.append(line)
+                    size += len(line)
+                    if size >= log_find_stream_buffer:
+                        yield "".join(buf).encode()
+                        buf = []
+                        size = 0
+                if not first or fmt != LogFindStream.ndjson:
+                    buf.append(end)
+                yield "".join(buf).encode()
+
+    return rows()
+
+
+async def get_find_stats(credentials) -> LogFindStats:
+    return LogFindStats(statements=len(find_statements.statements), connections=find_statements.connections(),
+                        hits=find_statements.hits, misses=find_statements.misses)
@@ -1,7 +1,9 @@
+from typing import List
 from pydantic import Field
 from common import I4cBaseModel, DatabaseConnection
 
 view_last_instance_sql = open("models/log/last_instance.sql").read()
+view_last_instances_sql = open("models/log/last_instances.sql").read()
 
 
 class LastInstance(I4cBaseModel):
@@ -10,6 +12,16 @@ class LastInstance(I4cBaseModel):
     sequence: str = Field(..., title="Last seen sequence number.")
 
 
+class LastInstanceDevice(LastInstance):
+    """Last known session of one of the devices."""
+    device: str = Field(..., title="Device.")
+
+
 async def get_last_instance(credentials, device, *, pconn=None):
     async with DatabaseConnection(pconn) as conn:
         return await conn.fetchrow(view_last_instance_sql, device)
+
+
+async def get_last_instances(credentials, devices: List[str], *, pconn=None):
+    async with DatabaseConnection(pconn) as conn:
+        return await conn.fetch(view_last_instances_sql, list(dict.fromkeys(devices)))
@@ -3,5 +3,5 @@ from log l
 where 
   l.instance is not null
   and l.device = $1
-order by l.timestamp desc, l.sequence desc
+order by l.timestamp desc nulls last, l.sequence desc nulls last
 limit 1
\ No newline at end of file
@@ -0,0 +1,12 @@
+select d.device, l.instance, l.sequence
+from unnest($1::varchar[]) d(device)
+cross join lateral (
+  select l.instance, l.sequence
+  from log l
+  where
+    l.instance is not null
+    and l.device = d.device
+  order by l.timestamp desc nulls last, l.sequence desc nulls last
+  limit 1
+) l
+order by d.device
\ No newline at end of file
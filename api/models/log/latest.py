@@ -0,0 +1,162 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Callable
+from common import DatabaseConnection, apicfg, log
+from .notify import LogChange, log_changes
+
+view_snapshot_sql = open("models/log/snapshot.sql").read()
+view_snapshot_fitered_events_sql = open("models/log/snapshot_fitered_events.sql").read()
+view_snapshot_events_sql = open("models/log/snapshot_events.sql").read()
+
+# keep in sync with snapshot_fitered_events.sql
+snapshot_filtered_event_ids = {'estop', 'ln', 'mode', 'pfo', 'pfr', 'rf', 'Sovr', 'pc'}
+snapshot_event_count = 20
+
+snapshot_devices = ('mill', 'lathe', 'gom', 'robot')
+log_snapshot_cache = bool(apicfg.get("log_snapshot_cache", True))
+
+ts_infinity = datetime.max
+
+
+class DeviceLatest:
+    """
+    Cached snapshot query results of a device at the end of the log: the last row per data_id, in the format
+    of snapshot.sql, and the last events, in the format of snapshot_fitered_events.sql and snapshot_events.sql.
+    """
+    __slots__ = ("latest", "filtered_events", "events", "newest")
+
+    def __init__(self, latest, filtered_events, events):
+        self.latest: Dict[str, dict] = {r["data_id"]: r for r in latest}
+        self.filtered_events: List[dict] = filtered_events
+        self.events: List[dict] = events
+        self.newest = max((r["timestamp"] for r in latest if r["timestamp"] is not None), default=None)
+
+    @staticmethod
+    def insert_event(events: List[dict], row: dict):
+        key = (row["timestamp"], row["sequence"])
+        if len(events) >= snapshot_event_count and key <= (events[-1]["timestamp"], events[-1]["sequence"]):
+            return
+        pos = 0
+        while pos < len(events) and (events[pos]["timestamp"], events[pos]["sequence"]) > key:
+            pos += 1
+        if pos < len(events) and (events[pos]["timestamp"], events[pos]["sequence"]) == key:
+            return
+        events.insert(pos, row)
+        del events[snapshot_event_count:]
+
+    def write(self, d):
+        """Applies a row inserted without override. Existing keys are left alone, as the insert does."""
+        meta = self.latest.get(d.data_id)
+        if meta is None:
+            # not in meta, the snapshot queries do not return it
+            return
+        # naive timestamps are stored as local time, the same way asyncpg does
+        timestamp = d.timestamp if d.timestamp.tzinfo is not None else d.timestamp.astimezone()
+        key = (timestamp, d.sequence)
+        if meta["timestamp"] is None or key > (meta["timestamp"], meta["sequence"]):
+            self.latest[d.data_id] = {**meta,
+                                      "value_num": d.value_num,
+                                      "value_text": d.value_text,
+                                      "value_extra": d.value_extra,
+                                      "value_aux": json.dumps(d.value_add) if d.value_add is not None else None,
+                                      "timestamp": timestamp,
+                                      "sequence": d.sequence}
+        event = {"data_id": d.data_id, "name": meta["name"], "nice_name": meta["nice_name"],
+                 "value": d.value_text, "timestamp": timestamp, "sequence": d.sequence}
+        self.insert_event(self.events, event)
+        if d.data_id in snapshot_filtered_event_ids:
+            self.insert_event(self.filtered_events, event)
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+
+
+class LatestValues:
+    """
+    Last values of the log per device, to serve snapshots of the current time from memory.
+
+    Devices are loaded with the snapshot queries at the end of the log, at startup or when first asked, and
+    kept up to date by the log write path. A cached snapshot is only used if the requested time is not earlier
+    than the newest cached row, older snapshots run the queries. Deletes and overriding writes drop the device,
+    it is loaded again on the next request. Changes committed by the other api processes, or in a transaction
+    of the caller, drop the device when their notification arrives, see LogChangeListener. Writes made around
+    the api are not seen, call invalidate after them. Listeners are called with the device name on every change.
+    """
+
+    def __init__(self):
+        self.devices: Dict[str, DeviceLatest] = {}
+        # bumped on every change of a device, a load is only kept if there was no change during it
+        self.versions: Dict[str, int] = {}
+        self.listeners: List[Callable[[str], None]] = []
+        log_changes.subscribe(self.changed)
+
+    def _bump(self, device):
+        device = str(getattr(device, "value", device))
+        self.versions[device] = self.versions.get(device, 0) + 1
+        for listener in self.listeners:
+            listener(device)
+
+    def invalidate(self, device=None):
+        if device is None:
+            for d in list(self.versions) + list(self.devices):
+                self._bump(d)
+            self.devices.clear()
+        else:
+            self._bump(device)
+            self.devices.pop(str(getattr(device, "value", device)), None)
+
+    def changed(self, change: LogChange):
+        if change.devices is None:
+            self.invalidate()
+        elif not change.local:
+            for device in change.devices:
+                self.invalidate(device)
+
+    def written(self, datapoints, *, override=False):
+        """Applies rows committed to the log."""
+        for d in datapoints:
+            device = str(getattr(d.device, "value", d.device))
+            self._bump(device)
+            if override:
+                self.devices.pop(device, None)
+                continue
+            cached = self.devices.get(device)
+            if cached is not None:
+                cached.write(d)
+
+    async def load(self, device, *, pconn=None) -> Optional[DeviceLatest]:
+        version = self.versions.get(device, 0)
+        async with DatabaseConnection(pconn) as conn:
+            latest = await conn.fetch(view_snapshot_sql, device, ts_infinity)
+            filtered_events = await conn.fetch(view_snapshot_fitered_events_sql, device, ts_infinity)
+            events = await conn.fetch(view_snapshot_events_sql, device, ts_infinity)
+        cached = DeviceLatest([dict(r) for r in latest], [dict(r) for r in filtered_events], [dict(r) for r in events])
+        if self.versions.get(device, 0) != version:
+            log.debug(f"snapshot cache: {device} changed while loading")
+            return None
+        self.devices[device] = cached
+        return cached
+
+    async def load_all(self, *, pconn=None):
+        if not log_snapshot_cache:
+            return
+        for device in snapshot_devices:
+            try:
+                await self.load(device, pconn=pconn)
+            except Exception as e:
+                log.error(f"snapshot cache: loading {device} failed: {e}")
+
+    async def get(self, device, ts: datetime, *, pconn=None) -> Optional[DeviceLatest]:
+        """Returns the cached rows of the device, if they are valid at ts. Otherwise None."""
+        if not log_snapshot_cache or ts.tzinfo is None:
+            return None
+        cached = self.devices.get(device)
+        if cached is None:
+            cached = await self.load(device, pconn=pconn)
+            if cached is None:
+                return None
+        if cached.newest is not None and ts < cached.newest:
+            return None
+        return cached
+
+
+latest_values = LatestValues()
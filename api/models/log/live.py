@@ -0,0 +1,156 @@
+import json
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional, AsyncIterator
+from common import apicfg, log
+from .latest import latest_values
+from .notify import LogChange, log_changes
+from .snapshot import get_snapshot
+
+log_live_interval = float(apicfg.get("log_live_interval", 0.5))
+log_live_refresh = float(apicfg.get("log_live_refresh", 10))
+log_live_keepalive = 15.0
+
+
+def merge_patch(old, new):
+    """Json merge patch (RFC 7386) that turns old into new. Lists are replaced as a whole."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {k: None for k in old.keys() - new.keys()}
+    for k, v in new.items():
+        if k not in old:
+            patch[k] = v
+        elif old[k] != v:
+            patch[k] = merge_patch(old[k], v)
+    return patch
+
+
+def sets_null(old, new):
+    """Tells if new sets a field to null compared to old. A merge patch can not do that, null deletes the field."""
+    if not isinstance(new, dict):
+        return False
+    if not isinstance(old, dict):
+        old = {}
+    for k, v in new.items():
+        if v is None:
+            if k not in old or old[k] is not None:
+                return True
+        elif sets_null(old.get(k), v):
+            return True
+    return False
+
+
+def delta_event(old, new):
+    """The delta event from old to new, or a full snapshot event if a field turned null."""
+    if sets_null(old, new):
+        return sse_event("snapshot", new)
+    return sse_event("delta", merge_patch(old, new))
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class DeviceFeed:
+    """
+    The live snapshot of one device. A single producer task builds the snapshot when the log of the device
+    changes, and publishes it with the delta to the previous version. The subscribers read the latest version,
+    a slow subscriber skips the versions it missed.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.changed = asyncio.Event()
+        self.published = asyncio.Condition()
+        self.version = 0
+        self.snapshot: Optional[dict] = None
+        self.delta: Optional[bytes] = None  # the event of the last change
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def produce(self):
+        while True:
+            try:
+                s = await get_snapshot(None, datetime.now(timezone.utc), self.device)
+                snapshot = json.loads(s.json())
+                if snapshot != self.snapshot:
+                    async with self.published:
+                        self.delta = delta_event(self.snapshot, snapshot) if self.snapshot is not None else None
+                        self.snapshot = snapshot
+                        self.version += 1
+                        self.published.notify_all()
+            except Exception as e:
+                log.error(f"live snapshot of {self.device}: {e}")
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=log_live_refresh)
+                # changes coming in a burst are sent together
+                await asyncio.sleep(log_live_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+
+    async def events(self) -> AsyncIterator[bytes]:
+        sent_version = 0
+        sent = None
+        while True:
+            async with self.published:
+                try:
+                    await asyncio.wait_for(self.published.wait_for(lambda: self.version > sent_version),
+                                           timeout=log_live_keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                (version, snapshot, delta) = (self.version, self.snapshot, self.delta)
+            if sent_version == 0:
+                yield sse_event("snapshot", snapshot)
+            elif version == sent_version + 1:
+                yield delta
+            else:
+                yield delta_event(sent, snapshot)
+            (sent_version, sent) = (version, snapshot)
+
+
+class SnapshotHub:
+    """
+    Live snapshot feeds, one per device while it has subscribers. Driven by the log change notifications, so
+    the writes of all the api processes reach the feeds, and by the changes of the log cache of this process.
+    """
+
+    def __init__(self):
+        self.feeds: Dict[str, DeviceFeed] = {}
+        latest_values.listeners.append(self.notify)
+        log_changes.subscribe(self.log_changed)
+
+    def log_changed(self, change: LogChange):
+        for device in list(self.feeds) if change.devices is None else change.devices:
+            self.notify(device)
+
+    def notify(self, device):
+        feed = self.feeds.get(device)
+        if feed is not None:
+            feed.changed.set()
+
+    async def subscribe(self, device) -> AsyncIterator[bytes]:
+        """
+        Server sent events of the device snapshot. The first event is the full snapshot, the following ones are
+        json merge patches to the previous one. A merge patch can not set a field to null, so when a field
+        turns null, the full snapshot is sent again instead.
+        """
+        device = str(getattr(device, "value", device))
+        feed = self.feeds.get(device)
+        if feed is None:
+            feed = DeviceFeed(device)
+            self.feeds[device] = feed
+            feed.task = asyncio.create_task(feed.produce())
+        feed.subscribers += 1
+        try:
+            async for event in feed.events():
+                yield event
+        finally:
+            feed.subscribers -= 1
+            if feed.subscribers == 0:
+                feed.task.cancel()
+                del self.feeds[device]
+
+
+snapshot_hub = SnapshotHub()
@@ -1,9 +1,28 @@
-from typing import List
+from typing import List, AsyncIterator
 from textwrap import dedent
-from common import DatabaseConnection
+from pydantic import Field, ValidationError
+from common import I4cBaseModel, DatabaseConnection, apicfg
 from common.db_tools import dict2asyncpg_param
-from common.exceptions import I4cClientError
-from models.log import DataPointLog
+from common.exceptions import I4cClientError, I4cInputValidationError
+from models.log import DataPointLog, DataPointDevice
+from .latest import latest_values
+from .meta import write_event_values
+from .notify import notify_log_change
+
+log_write_bulk_min = int(apicfg.get("log_write_bulk_min", 20))
+log_write_stream_chunk = int(apicfg.get("log_write_stream_chunk", 1000))
+
+log_write_columns = ("device", "instance", "timestamp", "sequence", "data_id",
+                     "value_num", "value_text", "value_extra", "value_aux")
+
+# the rows inserted or updated, for the event value catalogue, see write_event_values
+log_write_returning = 'RETURNING device, data_id, value_text, "timestamp"'
+
+
+class LogWriteStreamResult(I4cBaseModel):
+    """Result of a streamed log upload."""
+    chunks: List[int] = Field(..., title="Number of rows written, per chunk.")
+    total: int = Field(..., title="Total number of rows written.")
 
 
 async def check_data_id(conn, device, timestamp, sequence, data_id):
@@ -19,8 +38,17 @@ async def check_data_id(conn, device, timestamp, sequence, data_id):
         raise I4cClientError("data_id update is not allowed")
 
 
-async def put_log_write(credentials, datapoints: List[DataPointLog], *, override=False, pconn=None):
-    on_conflict = "DO NOTHING" if not override else """\
+def update_latest(conn, datapoints, override):
+    if conn.is_in_transaction():
+        # written in an outer transaction, that can still roll back
+        for d in datapoints:
+            latest_values.invalidate(d.device)
+    else:
+        latest_values.written(datapoints, override=override)
+
+
+def get_on_conflict(override):
+    return "DO NOTHING" if not override else """\
                    DO UPDATE SET 
                      instance = EXCLUDED.instance,
                      value_num = EXCLUDED.value_num,
@@ -28,6 +56,19 @@ async def put_log_write(credentials, datapoints: List[DataPointLog], *, override
                      value_extra = EXCLUDED.value_extra,
                      value_aux = EXCLUDED.value_aux
                    """
+
+
+async def put_log_write(credentials, datapoints: List[DataPointLog], *, override=False, bulk=None, pconn=None):
+    """
+    Writes the datapoints to the log. Batches of at least `log_write_bulk_min` items go through the
+    set based bulk path (see put_log_write_bulk), unless `bulk` is explicitly given.
+    Returns the number of rows inserted or updated, on both paths.
+    """
+    if bulk is None:
+        bulk = len(datapoints) >= log_write_bulk_min
+    if bulk:
+        return await put_log_write_bulk(credentials, datapoints, override=override, pconn=pconn)
+
     sql = dedent(f"""\
                  insert into log
                  (
@@ -43,15 +84,141 @@ async def put_log_write(credentials, datapoints: List[DataPointLog], *, override
                    )
                    values ($1, $2, $3, $4, $5, $6, $7, $8, $9)
                    ON CONFLICT (device, "timestamp", sequence)
-                   {on_conflict}""")
+                   {get_on_conflict(override)}
+                   {log_write_returning}""")
 
     async with DatabaseConnection(pconn) as conn:
+        local = not conn.is_in_transaction()
         async with conn.transaction():
+            written = []
             for d in datapoints:
                 if override:
                     await check_data_id(conn, d.device, d.timestamp,
                                    d.sequence, d.data_id)
-                await conn.execute(sql,
+                r = await conn.fetchrow(sql,
                                d.device, d.instance, d.timestamp,
                                d.sequence, d.data_id, d.value_num,
                                d.value_text, d.value_extra, dict2asyncpg_param(d.value_add))
+                if r is not None:
+                    written.append(r)
+            await write_event_values(conn, written)
+            await notify_log_change(conn, keys=((d.device, d.data_id) for d in datapoints), local=local)
+        update_latest(conn, datapoints, override)
+    return len(written)
+
+
+async def put_log_write_bulk(credentials, datapoints: List[DataPointLog], *, override=False, pconn=None):
+    """
+    Bulk variant of put_log_write. The batch is copied into a temp table with COPY, and merged into the log
+    with a single insert. Within the batch the first row wins for a key, or the last one if override is set,
+    the same as the row by row path would do. Returns the number of rows inserted or updated.
+    """
+    if not datapoints:
+        return 0
+
+    records = [(idx, d.device, d.instance, d.timestamp, d.sequence, d.data_id, d.value_num,
+                d.value_text, d.value_extra, dict2asyncpg_param(d.value_add))
+               for idx, d in enumerate(datapoints)]
+
+    # the table is left from an earlier call in the same outer transaction, if any
+    sql_stage = dedent("""\
+        create temp table if not exists log_write_stage (ord integer not null, like log)
+        on commit drop""")
+
+    sql_check = dedent("""\
+        select 1
+        from log_write_stage s
+        join log l on l.device = s.device and l."timestamp" = s."timestamp" and l.sequence = s.sequence
+        where l.data_id <> s.data_id
+        union all
+        select 1
+        from log_write_stage s
+        group by s.device, s."timestamp", s.sequence
+        having count(distinct s.data_id) > 1
+        limit 1""")
+
+    sql_merge = dedent(f"""\
+        insert into log
+        (
+           device,
+           instance,
+           "timestamp",
+           sequence,
+           data_id,
+           value_num,
+           value_text,
+           value_extra,
+           value_aux
+        )
+        select distinct on (s.device, s."timestamp", s.sequence)
+          s.device,
+          s.instance,
+          s."timestamp",
+          s.sequence,
+          s.data_id,
+          s.value_num,
+          s.value_text,
+          s.value_extra,
+          s.value_aux
+        from log_write_stage s
+        order by s.device, s."timestamp", s.sequence, s.ord {"desc" if override else "asc"}
+        ON CONFLICT (device, "timestamp", sequence)
+        {get_on_conflict(override)}
+        {log_write_returning}""")
+
+    async with DatabaseConnection(pconn) as conn:
+        local = not conn.is_in_transaction()
+        async with conn.transaction():
+            await conn.execute(sql_stage)
+            await conn.execute("truncate log_write_stage")
+            await conn.copy_records_to_table("log_write_stage", records=records,
+                                             columns=("ord",) + log_write_columns)
+            if override and await conn.fetchrow(sql_check):
+                raise I4cClientError("data_id update is not allowed")
+            written = await conn.fetch(sql_merge)
+            await write_event_values(conn, written)
+            await notify_log_change(conn, keys=((d.device, d.data_id) for d in datapoints), local=local)
+        update_latest(conn, datapoints, override)
+    return len(written)
+
+
+async def ndjson_lines(stream: AsyncIterator[bytes]):
+    buf = b""
+    async for chunk in stream:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line
+    yield buf
+
+
+async def put_log_write_stream(credentials, stream: AsyncIterator[bytes], *, chunk_size=None, pconn=None) -> LogWriteStreamResult:
+    """
+    Writes newline delimited json datapoints from the stream. Rows are validated and written in chunks of
+    `chunk_size`, each in its own transaction, so only one chunk is held in memory at a time.
+    """
+    chunk_size = chunk_size or log_write_stream_chunk
+    res = LogWriteStreamResult(chunks=[], total=0)
+
+    async def flush(chunk):
+        cnt = await put_log_write_bulk(credentials, chunk, pconn=conn)
+        res.chunks.append(cnt)
+        res.total += cnt
+
+    async with DatabaseConnection(pconn) as conn:
+        chunk = []
+        line_no = 0
+        async for line in ndjson_lines(stream):
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                chunk.append(DataPointDevice.parse_raw(line))
+            except ValidationError as e:
+                raise I4cInputValidationError(f"Line {line_no}: {e}. Rows written before: {res.total}")
+            if len(chunk) >= chunk_size:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+    return res
@@ -1,11 +1,14 @@
 import datetime
 from typing import Optional, List
 from pydantic import Field
+from textwrap import dedent
 from common import I4cBaseModel, DatabaseConnection
 
 view_meta_sql = open("models/log/meta.sql").read()
 view_meta_event_values_sql = open("models/log/meta_event_values.sql").read()
 
+meta_event_value_days = 90
+
 
 class Meta(I4cBaseModel):
     """Information about the data types in the log."""
@@ -31,21 +34,48 @@ class EventValue:
 async def get_meta(credentials, *, pconn=None):
     async with DatabaseConnection(pconn) as conn:
         rs = await conn.fetch(view_meta_sql)
-
-        after = datetime.date.today() + datetime.timedelta(-90)
+        after = datetime.date.today() + datetime.timedelta(-meta_event_value_days)
         rs_event_values = await conn.fetch(view_meta_event_values_sql, after)
 
-    l = {}
-    for row in rs_event_values:
-        key = (row["device"], row["data_id"])
-        if key in l.keys():
-            l[key].append(row["value"])
-        else:
-            l[key] = [row["value"]]
+    l = {(row["device"], row["data_id"]): row["values"] for row in rs_event_values}
 
     res = [dict(row) for row in rs]
 
     for r in res:
-        r["value_list"] = l[(r["device"], r["data_id"])] if (r["device"], r["data_id"]) in l.keys() else None
+        r["value_list"] = l.get((r["device"], r["data_id"]))
 
     return res
+
+
+async def write_event_values(conn, rows):
+    """
+    Adds the text values of the log rows to the event value catalogue, or moves their last_seen forward.
+    Only the EVENT data types are kept. rows are the rows the log write returned, the ones actually inserted
+    or updated, with device, data_id, value_text and timestamp. Call it in the transaction writing them.
+    """
+    last_seen = {}
+    for r in rows:
+        if r["value_text"] is None:
+            continue
+        key = (r["device"], r["data_id"], r["value_text"])
+        if key not in last_seen or last_seen[key] < r["timestamp"]:
+            last_seen[key] = r["timestamp"]
+    if not last_seen:
+        return
+
+    # sorted, so concurrent writers lock the catalogue rows in the same order
+    keys = sorted(last_seen)
+    sql = dedent("""\
+        insert into meta_event_value (device, data_id, value, last_seen)
+        select s.device, s.data_id, s.value, s.last_seen
+        from unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::timestamptz[]) with ordinality
+             s(device, data_id, value, last_seen, ord)
+        join meta m on m.device = s.device and m.data_id = s.data_id
+        where m.category = 'EVENT'
+        order by s.ord
+        on conflict (device, data_id, value)
+        do update set last_seen = excluded.last_seen
+        where meta_event_value.last_seen < excluded.last_seen""")
+    await conn.execute(sql,
+                       [k[0] for k in keys], [k[1] for k in keys], [k[2] for k in keys],
+                       [last_seen[k] for k in keys])
@@ -1,13 +1,10 @@
 select
-  l.device,
-  l.data_id, 
-  l.value_text "value",
-  count(*) "count"
-from meta m
-join log l on l.device = m.device and l.data_id = m.data_id
+  v.device,
+  v.data_id,
+  array_agg(v.value order by v.value) "values"
+from meta_event_value v
+join meta m on m.device = v.device and m.data_id = v.data_id
 where
-  l.timestamp >= $1::timestamp with time zone -- */ '2021-08-24 07:56:00.957133+02'::timestamp with time zone
+  v.last_seen >= $1::timestamp with time zone
   and m.category = 'EVENT'
-  and l.value_text is not null
-group by l.device, l.data_id, l.value_text 
-order by 1, 2, 3
\ No newline at end of file
+group by v.device, v.data_id
\ No newline at end of file
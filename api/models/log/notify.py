@@ -0,0 +1,124 @@
+import json
+import uuid
+import asyncio
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from common import DatabaseConnection, log
+
+log_change_channel = "log_change"
+log_change_max_payload = 7900  # notify payloads are limited to 8000 bytes
+log_change_check_interval = 60.0
+
+# tells the notifications of this process from the ones of the other workers
+process_id = uuid.uuid4().hex
+
+
+class LogChange:
+    """
+    A committed change of the log, received from any api process. keys are the written (device, data_id) pairs,
+    devices all the devices changed. Both are None if changes may have been missed, anything could have changed
+    then. local is set if this process applied the change to its caches already.
+    """
+    __slots__ = ("keys", "devices", "local")
+
+    def __init__(self, keys: Optional[Set[Tuple[str, str]]], devices: Optional[Set[str]], local: bool = False):
+        self.keys = keys
+        self.devices = devices
+        self.local = local
+
+
+def device_name(device) -> str:
+    return str(getattr(device, "value", device))
+
+
+async def notify_log_change(conn, *, keys: Iterable[Tuple[str, str]] = (), devices: Iterable = (), local=False):
+    """
+    Sends a log change to all api processes. Call it in the transaction of the change: the notification is
+    delivered when it commits, and dropped if it rolls back.
+    """
+    keys = sorted({(device_name(device), data_id) for device, data_id in keys})
+    devices = sorted({device_name(device) for device in devices} - {device for device, _ in keys})
+    def dumps(o):
+        return json.dumps(o, separators=(",", ":"))
+
+    payloads = []
+    items = [("keys", k) for k in keys] + [("devices", d) for d in devices]
+    chunk = {"from": process_id, "local": local, "keys": [], "devices": []}
+    size = len(dumps(chunk))
+    for name, item in items:
+        item_size = len(dumps(item)) + 1
+        if size + item_size > log_change_max_payload and (chunk["keys"] or chunk["devices"]):
+            payloads.append(dumps(chunk))
+            chunk = {"from": process_id, "local": local, "keys": [], "devices": []}
+            size = len(dumps(chunk))
+        chunk[name].append(item)
+        size += item_size
+    if chunk["keys"] or chunk["devices"]:
+        payloads.append(dumps(chunk))
+    if payloads:
+        await conn.execute("select pg_notify($1, p) from unnest($2::text[]) p", log_change_channel, payloads)
+
+
+class LogChangeListener:
+    """
+    Receives the log changes of all api processes on a LISTEN connection of its own, and passes them to the
+    subscribers. The connection is checked every log_change_check_interval seconds, and opened again if it
+    was lost, with a change of None keys and devices to the subscribers.
+    """
+
+    def __init__(self):
+        self.subscribers: List[Callable[[LogChange], None]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, callback: Callable[[LogChange], None]):
+        self.subscribers.append(callback)
+
+    def dispatch(self, change: LogChange):
+        for callback in self.subscribers:
+            try:
+                callback(change)
+            except Exception as e:
+                log.error(f"log change listener: {e}")
+
+    def received(self, conn, pid, channel, payload):
+        try:
+            p = json.loads(payload)
+            keys = {(device, data_id) for device, data_id in p["keys"]}
+            devices = set(p["devices"]) | {device for device, _ in keys}
+            local = p["from"] == process_id and p["local"]
+        except (ValueError, KeyError, TypeError) as e:
+            log.error(f"log change listener: invalid notification {payload!r}: {e}")
+            return
+        self.dispatch(LogChange(keys, devices, local))
+
+    async def run(self):
+        reconnect = False
+        while True:
+            conn = None
+            try:
+                conn = await DatabaseConnection.db_pool.acquire()
+                await conn.add_listener(log_change_channel, self.received)
+                if reconnect:
+                    self.dispatch(LogChange(None, None))
+                while True:
+                    await asyncio.sleep(log_change_check_interval)
+                    await conn.execute("select 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"log change listener: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        await DatabaseConnection.db_pool.release(conn)
+                    except Exception:
+                        pass
+            await asyncio.sleep(1)
+            reconnect = True
+
+    def start(self):
+        """Starts listening, call it after the db pool is created."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+
+log_changes = LogChangeListener()
@@ -4,6 +4,7 @@ from pydantic import Field
 from common import I4cBaseModel, DatabaseConnection
 from common.exceptions import I4cServerError
 from ..enums import DeviceAuto
+from .latest import latest_values, view_snapshot_sql, view_snapshot_fitered_events_sql, view_snapshot_events_sql
 
 
 class SnapshotStatusStatus(I4cBaseModel):
@@ -90,9 +91,6 @@ class Snapshot(I4cBaseModel):
     robot: Optional[SimpleSnapshot] = Field(None, title="Robot.")
 
 
-view_snapshot_sql = open("models/log/snapshot.sql").read()
-view_snapshot_fitered_events_sql = open("models/log/snapshot_fitered_events.sql").read()
-view_snapshot_events_sql = open("models/log/snapshot_events.sql").read()
 view_snapshot_auto_sql = open("models/log/snapshot_auto.sql").read()
 
 
@@ -102,8 +100,13 @@ def calc_secs(base, *data_times) -> float:
 
 async def get_mazak_snapshot(credentials, ts, device, *, pconn=None):
     async with DatabaseConnection(pconn) as conn:
-        rs = await conn.fetch(view_snapshot_sql, device, ts)
-        rse = await conn.fetch(view_snapshot_fitered_events_sql, device, ts)
+        cached = await latest_values.get(device, ts, pconn=conn)
+        if cached is not None:
+            rs = list(cached.latest.values())
+            rse = cached.filtered_events
+        else:
+            rs = await conn.fetch(view_snapshot_sql, device, ts)
+            rse = await conn.fetch(view_snapshot_fitered_events_sql, device, ts)
 
     try:
         params = {r['data_id']: r for r in rs}
@@ -163,7 +166,11 @@ async def get_mazak_snapshot(credentials, ts, device, *, pconn=None):
 
 async def get_simple_snapshot(credentials, ts, device, *, pconn=None):
     async with DatabaseConnection(pconn) as conn:
-        rse = await conn.fetch(view_snapshot_events_sql, device, ts)
+        cached = await latest_values.get(device, ts, pconn=conn)
+        if cached is not None:
+            rse = cached.events
+        else:
+            rse = await conn.fetch(view_snapshot_events_sql, device, ts)
 
     try:
         e = [SnapshotEvent(data_id=e['data_id'], name=e['name'], timestamp=e['timestamp'], value=e['value']) for e in rse]
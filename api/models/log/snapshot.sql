@@ -12,7 +12,8 @@ select
   l.value_text,
   l.value_extra,
   l.value_aux,
-  l.timestamp
+  l.timestamp,
+  l."sequence"
 from meta m
 left join lateral (select * 
        from log lf
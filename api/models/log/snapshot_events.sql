@@ -3,7 +3,8 @@ select
   coalesce(m.name,m.data_id) as name,
   coalesce(m.nice_name,m.name,m.data_id) as nice_name,
   l.value_text as value,
-  l.timestamp
+  l.timestamp,
+  l."sequence"
 from meta m
 join log l on l.device = m.device and l.data_id = m.data_id
 where 
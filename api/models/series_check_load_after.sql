@@ -0,0 +1,34 @@
+with
+  p as (select 
+     $1::varchar(200) -- */ 'lathe'
+       as device,
+     $2::varchar(200) -- */ 'cf'
+       as data_id
+   ),
+  after as (
+    select
+      l.timestamp,
+      l.sequence,
+      l.value_num,
+      l.value_text
+    from log l
+    cross join p
+    where 
+      l.timestamp >= $3::timestamp with time zone -- last row, used directly to allow partition pruning
+      and (l.timestamp, l.sequence) > ($3::timestamp with time zone, $4::integer)
+      and l.timestamp <= $5::timestamp with time zone -- */ '2021-08-24 07:56:00.957133+02'::timestamp with time zone
+      and l.device = p.device
+      and l.data_id = p.data_id
+  ),
+  closing as (
+    select
+      now() as timestamp,
+      0 as sequence,
+      null::double precision as value_num,
+      null::varchar(200) as value_text
+  )
+select * from after
+union all
+select * from closing
+
+order by timestamp asc, "sequence" asc
\ No newline at end of file
@@ -0,0 +1,61 @@
+with
+  p as (
+    select *
+    from unnest($1::varchar(200)[], $2::varchar(200)[], $3::timestamp with time zone[])
+           as p(device, data_id, last_check)
+  ),
+  before as (
+    select
+      p.device,
+      p.data_id,
+      b.timestamp,
+      b.sequence,
+      b.value_num,
+      b.value_text
+    from p
+    cross join lateral (
+      select
+        l.timestamp,
+        l.sequence,
+        l.value_num,
+        l.value_text
+      from log l
+      where 
+        l.timestamp <= p.last_check
+        and l.device = p.device
+        and l.data_id = p.data_id
+      order by l.timestamp desc, l."sequence" desc
+      limit 1
+    ) b
+  ),
+  after as (
+    select
+      p.device,
+      p.data_id,
+      l.timestamp,
+      l.sequence,
+      l.value_num,
+      l.value_text
+    from p
+    join log l on l.device = p.device and l.data_id = p.data_id
+    where 
+      l.timestamp > $4::timestamp with time zone -- the earliest last_check, used directly to allow partition pruning
+      and l.timestamp > p.last_check
+      and l.timestamp <= $5::timestamp with time zone -- */ '2021-08-24 07:56:00.957133+02'::timestamp with time zone
+  ),
+  closing as (
+    select
+      null::varchar(200) as device,
+      null::varchar(200) as data_id,
+      now() as timestamp,
+      0 as sequence,
+      null::double precision as value_num,
+      null::varchar(200) as value_text
+  )
+select * from before
+union all
+select * from after
+union all
+select * from closing
+
+order by device, data_id, timestamp asc, "sequence" asc
\ No newline at end of file
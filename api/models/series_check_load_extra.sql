@@ -19,7 +19,7 @@ with
     from log l
     cross join p
     where 
-      l.timestamp <= p.last_check
+      l.timestamp <= $3::timestamp with time zone -- p.last_check, used directly to allow partition pruning
       and l.device = p.device
       and l.data_id = p.data_id
     order by l.timestamp desc, l."sequence" desc
@@ -35,8 +35,8 @@ with
     from log l
     cross join p
     where 
-      l.timestamp > p.last_check
-      and l.timestamp <= p."now"
+      l.timestamp > $3::timestamp with time zone -- p.last_check
+      and l.timestamp <= $4::timestamp with time zone -- p."now"
       and l.device = p.device
       and l.data_id = p.data_id
   ),
@@ -8,6 +8,7 @@ from textwrap import dedent
 from typing import Optional, List
 from pydantic import root_validator, validator, Field
 from common import series_intersect
+from common.interval_set import IntervalSet
 from common.exceptions import I4cServerError
 from common import I4cBaseModel
 from common.cmp_list import cmp_list
@@ -245,20 +246,20 @@ class StatCapabilityData(I4cBaseModel):
 async def statdata_get_capability(credentials, st_id:int, st_capabilitydef: StatCapabilityDef, conn) -> StatCapabilityData:
     after, before = resolve_time_period(st_capabilitydef.after, st_capabilitydef.before, st_capabilitydef.duration)
 
-    total_series = series_intersect.Series()
-    total_series.add(series_intersect.TimePeriod(after, before))
+    filter_sets = [IntervalSet.from_periods([series_intersect.TimePeriod(after, before)])]
 
     filters = await conn.fetch("select * from stat_capability_filter where capability = $1", st_id)
     # todo 5: maybe use "timestamp" AND "sequence" for intervals instead of "timestamp" only
     for filter in filters:
         db_series = await conn.fetch(series_check_load_sql, filter["device"], filter["data_id"], after, before)
-        current_series = series_intersect.Series()
+        current_periods = []
         for r_series_prev, r_series in prev_iterator(db_series, include_first=False):
             if check_rel(filter["rel"], filter["value"], r_series_prev["value_text"]):
                 t = series_intersect.TimePeriod(r_series_prev["timestamp"], r_series["timestamp"])
-                current_series.add(t)
-        total_series = series_intersect.Series.intersect(total_series, current_series)
-        del current_series
+                current_periods.append(t)
+        filter_sets.append(IntervalSet.from_periods(current_periods))
+        del current_periods
+    total_series = filter_sets[0].intersect(*filter_sets[1:]).to_series()
 
 
     res = dict(points=[], mean=None, sigma=None, c=None, ck=None)
@@ -269,8 +270,9 @@ async def statdata_get_capability(credentials, st_id:int, st_capabilitydef: Stat
                                      total_series[0].start or after,
                                      total_series[-1].end or before)
 
-        for md_prev, md in prev_iterator(md_series, include_first=False):
-            if not total_series.is_timestamp_in(md_prev["timestamp"]):
+        in_total = total_series.timestamps_in(md["timestamp"] for md in md_series)
+        for md_idx, (md_prev, md) in enumerate(prev_iterator(md_series, include_first=False)):
+            if not in_total[md_idx]:
                 continue
             if md_prev["value_num"] is not None:
                 res["points"].append(md_prev["value_num"])
@@ -7,6 +7,7 @@ from textwrap import dedent
 from typing import Optional, List
 from pydantic import root_validator, validator, Field
 from common import series_intersect
+from common.interval_set import IntervalSet
 from common.exceptions import I4cServerError
 from common import I4cBaseModel
 from common.cmp_list import cmp_list
@@ -263,14 +264,13 @@ class StatTimeseriesDataSeries(I4cBaseModel):
 async def statdata_get_timeseries(credentials, st_id:int, st_timeseriesdef: StatTimeseriesDef, conn) -> List[StatTimeseriesDataSeries]:
     after, before = resolve_time_period(st_timeseriesdef.after, st_timeseriesdef.before, st_timeseriesdef.duration)
 
-    total_series = series_intersect.Series()
-    total_series.add(series_intersect.TimePeriod(after, before))
+    filter_sets = [IntervalSet.from_periods([series_intersect.TimePeriod(after, before)])]
 
     filters = await conn.fetch("select * from stat_timeseries_filter where timeseries = $1", st_id)
     # todo 5: maybe use "timestamp" AND "sequence" for intervals instead of "timestamp" only
     for filter in filters:
         db_series = await conn.fetch(series_check_load_sql, filter["device"], filter["data_id"], after, before)
-        current_series = series_intersect.Series()
+        current_periods = []
         for r_series_prev, r_series in prev_iterator(db_series, include_first=False):
             if check_rel(filter["rel"], filter["value"], r_series_prev["value_text"]):
                 age_min = timedelta(seconds=filter["age_min"] if filter["age_min"] and filter["age_min"] > 0 else 0)
@@ -282,9 +282,10 @@ async def statdata_get_timeseries(credentials, st_id:int, st_timeseriesdef: Stat
                     else:
                         t = series_intersect.TimePeriod(r_series_prev["timestamp"] + age_min,
                                                         r_series_prev["timestamp"] + age_max)
-                    current_series.add(t)
-        total_series = series_intersect.Series.intersect(total_series, current_series)
-        del current_series
+                    current_periods.append(t)
+        filter_sets.append(IntervalSet.from_periods(current_periods))
+        del current_periods
+    total_series = filter_sets[0].intersect(*filter_sets[1:]).to_series()
 
 
     def create_StatTimeseriesDataSeries():
@@ -347,8 +348,9 @@ async def statdata_get_timeseries(credentials, st_id:int, st_timeseriesdef: Stat
 
         agg_values = []
         md_prev = None
-        for md_prev, md in prev_iterator(md_series, include_first=False):
-            if not total_series.is_timestamp_in(md_prev["timestamp"]):
+        in_total = total_series.timestamps_in(md["timestamp"] for md in md_series)
+        for md_idx, (md_prev, md) in enumerate(prev_iterator(md_series, include_first=False)):
+            if not in_total[md_idx]:
                 continue
 
             aggregated_value = None
@@ -0,0 +1,204 @@
+import os
+import time
+import zlib
+import shutil
+import struct
+import logging
+import threading
+
+log = logging.getLogger("i4c")
+
+record_header = struct.Struct("<4sII")  # marker, payload length, crc32 of the payload
+record_marker = b"\xffI4C"  # 0xff does not occur in utf-8 json, so a damaged segment is searched for it
+
+
+class LogSpool:
+    """
+    Durable local buffer for log uploads.
+
+    Batches of log rows are appended to segment files in the spool directory, as json array payloads with a
+    marker, length and crc32 header. The sender reads the segments oldest first, concatenates many batches into one
+    request, and records the position after every successful upload. Fully sent segments are deleted.
+
+    A damaged record is skipped, and reading goes on with the next valid record. The segment is then copied to a
+    .bad file next to it before it is deleted, so the skipped bytes can still be looked at.
+
+    Re-sending after a crash is harmless, the log ignores rows already written. One spool directory should be
+    used by one process only.
+    """
+
+    def __init__(self, path, send, *, segment_size=16 * 1024 * 1024, batch_size=4 * 1024 * 1024, sync=False):
+        """
+        :param path: spool directory, created if missing.
+        :param send: callable taking the json array body as bytes. Must raise if the upload failed.
+        :param segment_size: the writer starts a new segment if the current one reaches this size, bytes.
+        :param batch_size: the sender stops adding batches to a request above this size, bytes.
+        :param sync: fsync after every append.
+        """
+        self.path = path
+        self.send = send
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        os.makedirs(path, exist_ok=True)
+
+    def _segment_name(self, segment):
+        return os.path.join(self.path, f"{segment:012d}.seg")
+
+    def _segments(self):
+        return sorted(int(fn[:-4]) for fn in os.listdir(self.path) if fn.endswith(".seg") and fn[:-4].isdigit())
+
+    def _open_writer(self):
+        # numbered after the sent position too, a reused number would be skipped up to the saved offset
+        segments = self._segments()
+        pos_segment, _ = self._load_position()
+        self._segment = max(segments[-1] if segments else 0, pos_segment) + 1
+        self._file = open(self._segment_name(self._segment), "ab")
+
+    def append(self, body: bytes):
+        """Stores a json array of log rows."""
+        record = record_header.pack(record_marker, len(body), zlib.crc32(body)) + body
+        with self._lock:
+            if self._file is None:
+                self._open_writer()
+            elif self._file.tell() >= self.segment_size:
+                self._file.close()
+                self._segment += 1
+                self._file = open(self._segment_name(self._segment), "ab")
+            self._file.write(record)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.path, "position")) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except FileNotFoundError:
+            return 0, 0
+
+    def _save_position(self, segment, offset):
+        fn = os.path.join(self.path, "position")
+        with open(fn + ".tmp", "w") as f:
+            f.write(f"{segment} {offset}")
+        os.replace(fn + ".tmp", fn)
+
+    @staticmethod
+    def _find_record(data, start):
+        """Position of the first valid record in data from start, or None."""
+        pos = data.find(record_marker, start)
+        while pos != -1 and pos + record_header.size <= len(data):
+            _, length, crc = record_header.unpack_from(data, pos)
+            payload_start = pos + record_header.size
+            if 2 <= length <= len(data) - payload_start \
+                    and zlib.crc32(data[payload_start:payload_start + length]) == crc:
+                return pos
+            pos = data.find(record_marker, pos + 1)
+        return None
+
+    def _read_records(self, segment, offset, final, damaged):
+        """
+        Yields (payload, end offset) of the valid records of the segment from offset. A damaged record is
+        skipped, reading resumes at the next valid record, and its offset is added to damaged. A partial record
+        at the end is left for later, unless the segment is final, then it is treated as damaged.
+        """
+        with open(self._segment_name(segment), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(record_header.size)
+                if not header:
+                    return
+                marker, length, crc = record_header.unpack(header) if len(header) == record_header.size \
+                    else (None, None, None)
+                payload = f.read(length) if marker == record_marker else b""
+                if marker == record_marker and len(payload) == length and zlib.crc32(payload) == crc:
+                    offset += record_header.size + length
+                    yield payload, offset
+                    continue
+                # a wrong marker is damage, a short header or payload can still be in the writing
+                complete = marker is not None and (marker != record_marker or len(payload) == length)
+                if not complete and not final:
+                    return
+                f.seek(offset)
+                data = f.read()
+                pos = self._find_record(data, 1)
+                if pos is None and not final:
+                    # nothing valid after it yet, looked at again by the next drain
+                    return
+                damaged.append(offset)
+                problem = "partial record" if not complete else \
+                    "checksum error" if marker == record_marker else "bad record header"
+                if pos is None:
+                    log.error(f"spool: {problem} in segment {segment} at {offset}, {len(data)} bytes skipped")
+                    return
+                log.error(f"spool: {problem} in segment {segment} at {offset}, {pos} bytes skipped")
+                offset += pos
+                f.seek(offset)
+
+    def _quarantine(self, segment):
+        fn = self._segment_name(segment)
+        if not os.path.exists(fn + ".bad"):
+            shutil.copyfile(fn, fn + ".bad")
+            log.error(f"spool: segment {segment} had damaged records, copied to {fn}.bad")
+
+    def drain(self):
+        """Sends everything in the spool. Returns the number of batches sent, raises if an upload fails."""
+        with self._send_lock:
+            sent = 0
+            pos_segment, pos_offset = self._load_position()
+            for segment in self._segments():
+                # segments below the position are left overs of a failed delete, sent again from the start
+                offset = pos_offset if segment == pos_segment else 0
+                # checked before reading: once the writer moved on, the segment does not change any more
+                with self._lock:
+                    active = self._file is not None and segment == self._segment
+                parts = []
+                size = 0
+                damaged = []
+                for payload, end in self._read_records(segment, offset, not active, damaged):
+                    part = payload.strip()[1:-1].strip()
+                    if part:
+                        parts.append(part)
+                        size += len(part)
+                    sent += 1
+                    offset = end
+                    if size >= self.batch_size:
+                        self.send(b"[" + b",".join(parts) + b"]")
+                        self._save_position(segment, offset)
+                        parts = []
+                        size = 0
+                if damaged:
+                    self._quarantine(segment)
+                if parts:
+                    self.send(b"[" + b",".join(parts) + b"]")
+                self._save_position(segment, offset)
+                if not active:
+                    os.remove(self._segment_name(segment))
+            return sent
+
+    def start_sender(self, interval=1.0):
+        """Starts a daemon thread that drains the spool every interval seconds."""
+        def run():
+            while True:
+                try:
+                    sent = self.drain()
+                    if sent:
+                        log.debug(f"spool: sent {sent} batches")
+                except Exception as e:
+                    log.error(f"spool: upload failed: {e}")
+                time.sleep(interval)
+
+        t = threading.Thread(target=run, name="spool sender", daemon=True)
+        t.start()
+        return t
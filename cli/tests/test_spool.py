@@ -0,0 +1,66 @@
+import os
+import json
+
+from i4c.spool import LogSpool
+
+
+def make_spool(path, sent, **kwargs):
+    return LogSpool(str(path), lambda body: sent.extend(r["i"] for r in json.loads(body)), **kwargs)
+
+
+def append(spool, start, count):
+    for i in range(start, start + count):
+        spool.append(json.dumps([{"i": i}]).encode())
+
+
+def segment_files(path):
+    return sorted(fn for fn in os.listdir(path) if fn.endswith(".seg"))
+
+
+def test_append_drain_runs(tmp_path):
+    # every run closes and drains the spool, the next run starts a new writer on the same directory
+    sent = []
+    spool = make_spool(tmp_path, sent)
+    append(spool, 0, 3)
+    spool.close()
+    assert spool.drain() == 3
+
+    spool = make_spool(tmp_path, sent, segment_size=20)
+    append(spool, 3, 2)
+    spool.close()
+    assert spool.drain() == 2
+
+    spool = make_spool(tmp_path, sent)
+    append(spool, 5, 1)
+    assert spool.drain() == 1
+    append(spool, 6, 1)
+    spool.close()
+    assert spool.drain() == 1
+
+    assert sent == list(range(7))
+    assert segment_files(tmp_path) == []
+
+
+def test_damaged_records(tmp_path):
+    sent = []
+    spool = make_spool(tmp_path, sent, segment_size=100)
+    append(spool, 0, 12)
+    spool.close()
+    segments = segment_files(tmp_path)
+    assert len(segments) == 3  # 22 byte records, 5 of them fill a segment
+
+    def damage(fn, offset, value):
+        data = bytearray((tmp_path / fn).read_bytes())
+        data[offset] = value
+        (tmp_path / fn).write_bytes(bytes(data))
+
+    damage(segments[0], 14, ord("X"))  # payload of record 0
+    damage(segments[1], 0, 0)  # marker of record 5
+    data = (tmp_path / segments[2]).read_bytes()
+    (tmp_path / segments[2]).write_bytes(data[:-3])  # record 11 cut short
+
+    assert spool.drain() == 9
+    assert sent == [1, 2, 3, 4, 6, 7, 8, 9, 10]
+    assert sorted(fn for fn in os.listdir(tmp_path) if fn.endswith(".bad")) == \
+        [fn + ".bad" for fn in segments]
+    assert segment_files(tmp_path) == []